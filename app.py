@@ -4,6 +4,17 @@ from routes.post_call_webhook import router as postcall_router
 from routes.retry_calls import router as retry_router  
 from routes.bitrix_activity_webhook import router as bitrix_activity_router
 from routes.call_now_webhook import router as call_now_router
+from routes.bitrix_deal_webhook import router as bitrix_deal_router
+from helpers.bitrix_rate_limiter import rate_governor
+from helpers.lead_cache import lead_cache
+from helpers.bitrix_metadata import bitrix_metadata
+from helpers.deal_index import deal_index
+from helpers.blocking import blocking_pool_state
+from helpers import ingest_queue
+from helpers.idempotency import post_call_dedupe
+from helpers.activity_coalescer import activity_coalescer
+from helpers.audit_log import audit_log
+from helpers.dial_engine import dial_engine
 
 
 app = FastAPI()
@@ -12,9 +23,47 @@ app.include_router(bolna_router, prefix="")
 app.include_router(postcall_router, prefix="")
 app.include_router(retry_router, prefix="")
 app.include_router(bitrix_activity_router, prefix="")
+app.include_router(bitrix_deal_router, prefix="")
 
 app.include_router(call_now_router)
 
+
+@app.on_event("startup")
+def load_bitrix_metadata():
+    bitrix_metadata.start_background_refresh()
+
+
+@app.on_event("startup")
+def start_deal_index():
+    deal_index.start_background_sync()
+
+
+@app.on_event("startup")
+def warm_idempotency_set():
+    post_call_dedupe.warm()
+
+
+@app.on_event("startup")
+async def start_ingest_workers():
+    await ingest_queue.start_workers()
+
+
+@app.on_event("shutdown")
+async def stop_ingest_workers():
+    await ingest_queue.stop_workers()
+
+
+@app.on_event("startup")
+def start_audit_log():
+    audit_log.start()
+
+
+@app.on_event("shutdown")
+def flush_activity_bursts():
+    activity_coalescer.flush_all()
+    # After the coalescer: its flush queues manual_call_logs rows
+    audit_log.stop()
+
 print("\n🔍 Registered routes:")
 for route in app.routes:
     print("→", route.path)
@@ -23,3 +72,19 @@ for route in app.routes:
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/health/bitrix")
+def bitrix_health():
+    return {
+        "rate_limit": rate_governor.state(),
+        "lead_cache": lead_cache.stats(),
+        "metadata": bitrix_metadata.state(),
+        "deal_index": deal_index.state(),
+        "blocking_pool": blocking_pool_state(),
+        "ingest_queue": ingest_queue.queue_state(),
+        "post_call_dedupe": post_call_dedupe.state(),
+        "activity_coalescer": activity_coalescer.state(),
+        "audit_log": audit_log.state(),
+        "dial_engine": dial_engine.state(),
+    }
@@ -0,0 +1,77 @@
+# benchmarks/bench_calling_calendar.py
+"""
+Compare the compiled calling calendar with the previous per-call
+window functions on "next allowed instant >= t".
+
+    python benchmarks/bench_calling_calendar.py [N]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers.calling_calendar import CallingCalendar  # noqa: E402
+
+IST = pytz.timezone("Asia/Kolkata")
+
+
+# ---------------- previous implementation (retry_manager, before the engine) ----------------
+
+def legacy_is_within_window(now_ist):
+    return 9 <= now_ist.hour < 18
+
+
+def legacy_next_window_start(now_ist):
+    if now_ist.hour < 9:
+        return now_ist.replace(hour=9, minute=0, second=0, microsecond=0)
+    if now_ist.hour >= 18:
+        next_day = now_ist + timedelta(days=1)
+        return next_day.replace(hour=9, minute=0, second=0, microsecond=0)
+    return now_ist
+
+
+def legacy_is_sunday_blackout(now_ist):
+    return now_ist.weekday() == 6 and 10 <= now_ist.hour < 12
+
+
+def legacy_next_allowed(ts: float) -> float:
+    now_ist = datetime.fromtimestamp(ts, timezone.utc).astimezone(IST)
+    if legacy_is_sunday_blackout(now_ist):
+        return now_ist.replace(hour=12, minute=1, second=0, microsecond=0).timestamp()
+    if legacy_is_within_window(now_ist):
+        return ts
+    return legacy_next_window_start(now_ist).timestamp()
+
+
+# ---------------- benchmark ----------------
+
+def timed(label, fn, n):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms   {elapsed / n * 1e6:7.2f} µs/row")
+    return result
+
+
+def main(n: int = 100_000):
+    random.seed(7)
+    now = time.time()
+    stamps = [now + random.uniform(0, 30 * 86400) for _ in range(n)]
+
+    calendar = CallingCalendar(holidays="")
+    calendar.compile(now)
+
+    legacy = timed("legacy (per call)", lambda: [legacy_next_allowed(t) for t in stamps], n)
+    compiled = timed("calendar.resume_ts", lambda: [calendar.resume_ts(t) for t in stamps], n)
+
+    mismatches = sum(1 for a, b in zip(legacy, compiled) if abs(a - b) > 1e-6)
+    print(f"\nrows: {n}   legacy≠calendar: {mismatches}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
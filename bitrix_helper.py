@@ -1,28 +1,15 @@
-import requests
-import os
-
-# Replace with your webhook URL (no method at the end, just base)
-BITRIX_WEBHOOK_URL = os.getenv("BITRIX_WEBHOOK")
+from helpers.bitrix_metadata import bitrix_metadata, LEAD_STATUS_ENTITY
 
 def get_lead_statuses():
     """Fetch and print all lead statuses from Bitrix24."""
-    url = BITRIX_WEBHOOK_URL + "crm.status.list.json"
-    response = requests.get(url)
-
-    if response.status_code != 200:
-        print("Error fetching data:", response.text)
-        return None
-
-    data = response.json()
-    if "result" not in data:
-        print("Unexpected response:", data)
+    if not bitrix_metadata.refresh():
+        print("Error fetching statuses from Bitrix")
         return None
 
-    statuses = data["result"]
+    statuses = bitrix_metadata.statuses(LEAD_STATUS_ENTITY)  # only lead statuses
     print("Lead Statuses in Bitrix:")
     for status in statuses:
-        if status["ENTITY_ID"] == "STATUS":  # only lead statuses
-            print(f"{status['STATUS_ID']} - {status['NAME']}")
+        print(f"{status['STATUS_ID']} - {status['NAME']}")
 
     return statuses
 
@@ -0,0 +1,111 @@
+# helpers/activity_coalescer.py
+"""
+Per-lead coalescing window for /bitrix-activity-webhook.
+
+One post-call run or one human call session fires a burst of activity
+events for the same owner. The retry cancel is applied right away by the
+first event (it must be durable before the webhook is acknowledged), and
+repeats within ACTIVITY_COALESCE_SECONDS are skipped. Only the
+manual_call_logs rows are buffered per lead and written as one batch.
+"""
+import os
+import threading
+import time
+
+from helpers.audit_log import audit_log
+from helpers.own_activities import own_activities
+from helpers.retry_manager import cancel_retry_for_lead
+
+ACTIVITY_COALESCE_SECONDS = float(os.getenv("ACTIVITY_COALESCE_SECONDS", "5"))
+
+
+class ActivityCoalescer:
+    def __init__(self, window: float = ACTIVITY_COALESCE_SECONDS):
+        self.window = window
+        self._pending: dict[str, list[dict]] = {}
+        self._timers: dict[str, threading.Timer] = {}
+        self._cancelled_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self.events = 0
+        self.flushes = 0
+        self.cancels = 0
+
+    def cancel_once(self, lead_id) -> bool:
+        """
+        Pause the lead's retries now, unless that was already done within
+        the window. Returns True when a cancel was written. Raises when the
+        write failed, so a queued webhook is retried instead of acknowledged.
+        """
+        key = str(lead_id)
+        now = time.monotonic()
+        with self._lock:
+            last = self._cancelled_at.get(key)
+            if last is not None and now - last < self.window:
+                return False
+            # Forget old entries so the map stays small
+            for k in [k for k, t in self._cancelled_at.items() if now - t >= self.window]:
+                del self._cancelled_at[k]
+
+        print(f"📞 HUMAN manual call detected for LEAD {key}. Cancelling retries.")
+        if cancel_retry_for_lead(key, reason="manual_call_detected") is None:
+            raise RuntimeError(f"retry cancel failed for lead {key}")
+
+        with self._lock:
+            self._cancelled_at[key] = now
+            self.cancels += 1
+        return True
+
+    def submit(self, lead_id, log_row: dict) -> int:
+        """Buffer a manual-call log row; returns how many are pending for the lead."""
+        key = str(lead_id)
+        with self._lock:
+            self.events += 1
+            rows = self._pending.setdefault(key, [])
+            rows.append(log_row)
+
+            if key not in self._timers:
+                timer = threading.Timer(self.window, self.flush, args=(key,))
+                timer.daemon = True
+                self._timers[key] = timer
+                timer.start()
+
+            return len(rows)
+
+    def flush(self, lead_id):
+        key = str(lead_id)
+        with self._lock:
+            rows = self._pending.pop(key, [])
+            timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+        # Our own activity may have been reported before its add() returned
+        rows = [r for r in rows if r.get("activity_id") not in own_activities]
+        if not rows:
+            return
+
+        self.flushes += 1
+
+        # Logged by the batched audit writer
+        for row in rows:
+            audit_log.write("manual_call_logs", row)
+
+    def flush_all(self):
+        with self._lock:
+            keys = list(self._pending)
+        for key in keys:
+            self.flush(key)
+
+    def state(self) -> dict:
+        with self._lock:
+            return {
+                "window_sec": self.window,
+                "pending_leads": len(self._pending),
+                "events": self.events,
+                "cancels": self.cancels,
+                "flushes": self.flushes,
+            }
+
+
+activity_coalescer = ActivityCoalescer()
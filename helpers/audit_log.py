@@ -0,0 +1,174 @@
+# helpers/audit_log.py
+"""
+Batched background writer for Supabase audit tables (webhook_logs,
+manual_call_logs, bolna_call_logs). Only write-only logs belong here:
+lead_email_log is read back for the once-per-day email check, so
+email_sender still writes it synchronously.
+
+Request paths call audit_log.write(table, row) and return immediately. A
+daemon thread flushes buffered rows as multi-row inserts when a table
+reaches AUDIT_LOG_BATCH_SIZE rows or every AUDIT_LOG_FLUSH_SECONDS. If
+Supabase rejects an insert, only the rows of that insert are spilled to a
+local JSONL file and replayed on the next successful flush. Rows that still
+fail after AUDIT_LOG_MAX_ATTEMPTS inserts are moved to a dead-letter file.
+"""
+import json
+import os
+import threading
+import time
+
+from config import supabase
+from helpers.logger import logger
+
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "100"))
+AUDIT_LOG_FLUSH_SECONDS = float(os.getenv("AUDIT_LOG_FLUSH_SECONDS", "2"))
+AUDIT_LOG_MAX_BUFFER = int(os.getenv("AUDIT_LOG_MAX_BUFFER", "10000"))
+AUDIT_LOG_SPILL_PATH = os.getenv("AUDIT_LOG_SPILL_PATH", "audit_log_spill.jsonl")
+AUDIT_LOG_DEAD_PATH = os.getenv("AUDIT_LOG_DEAD_PATH", "audit_log_dead.jsonl")
+AUDIT_LOG_MAX_ATTEMPTS = int(os.getenv("AUDIT_LOG_MAX_ATTEMPTS", "5"))
+
+
+class AuditLogWriter:
+    def __init__(self, spill_path: str = AUDIT_LOG_SPILL_PATH, dead_path: str = AUDIT_LOG_DEAD_PATH):
+        self.spill_path = spill_path
+        self.dead_path = dead_path
+        self._buffers: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self.written = 0
+        self.spilled = 0
+        self.dead = 0
+        self.failed_flushes = 0
+
+    # ---------------- producer side ----------------
+
+    def write(self, table: str, row: dict):
+        """Queue one row; never blocks on Supabase."""
+        with self._lock:
+            rows = self._buffers.setdefault(table, [])
+            rows.append(row)
+            size = len(rows)
+            total = sum(len(r) for r in self._buffers.values())
+
+        if self._thread is None:
+            # Writer not started (cron script, shell): keep the old behaviour
+            self.flush()
+        elif size >= AUDIT_LOG_BATCH_SIZE or total >= AUDIT_LOG_MAX_BUFFER:
+            self._wake.set()
+
+    # ---------------- flushing ----------------
+
+    def _insert(self, table: str, rows: list[dict]) -> list[dict]:
+        """Insert rows in batches; returns the rows of the batches that failed."""
+        # PostgREST bulk inserts need the same keys on every object
+        groups: dict[tuple, list[dict]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+
+        failed = []
+        for group in groups.values():
+            for i in range(0, len(group), AUDIT_LOG_BATCH_SIZE):
+                chunk = group[i:i + AUDIT_LOG_BATCH_SIZE]
+                try:
+                    supabase.table(table).insert(chunk).execute()
+                    self.written += len(chunk)
+                except Exception as e:
+                    logger.warning(f"❌ Audit insert into {table} failed ({len(chunk)} rows): {e}")
+                    failed.extend(chunk)
+        return failed
+
+    def _spill(self, table: str, rows: list[dict], attempts: int = 1):
+        """Keep failed rows for replay, or dead-letter them once out of attempts."""
+        if attempts >= AUDIT_LOG_MAX_ATTEMPTS:
+            path = self.dead_path
+            self.dead += len(rows)
+            logger.error(f"☠️ Audit rows for {table} failed {attempts} times, moved to {path} ({len(rows)} rows)")
+        else:
+            path = self.spill_path
+            self.spilled += len(rows)
+
+        with open(path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({"table": table, "row": row, "attempts": attempts}, default=str) + "\n")
+
+    def _replay_spill(self):
+        replay_path = self.spill_path + ".replay"
+        if not os.path.exists(replay_path):
+            if not os.path.exists(self.spill_path):
+                return
+            os.replace(self.spill_path, replay_path)
+        # else: a replay crashed half-way; finish that file first and pick
+        # up the current spill file on the next flush, so neither is lost
+
+        pending: dict[tuple[str, int], list[dict]] = {}
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    key = (item["table"], item.get("attempts", 1))
+                    pending.setdefault(key, []).append(item["row"])
+
+        for (table, attempts), rows in pending.items():
+            failed = self._insert(table, rows)
+            if failed:
+                self._spill(table, failed, attempts + 1)
+
+        os.remove(replay_path)
+        logger.info(f"♻️ Audit log: replayed spill file ({sum(len(r) for r in pending.values())} rows)")
+
+    def flush(self):
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+
+        with self._flush_lock:
+            healthy = True
+            for table, rows in buffers.items():
+                failed = self._insert(table, rows)
+                if failed:
+                    healthy = False
+                    self.failed_flushes += 1
+                    self._spill(table, failed)
+
+            if healthy and buffers:
+                try:
+                    self._replay_spill()
+                except Exception as e:
+                    logger.warning(f"⚠️ Audit spill replay error: {e}")
+
+    def _loop(self):
+        while True:
+            self._wake.wait(timeout=AUDIT_LOG_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"🔥 Audit log flush error: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="audit-log")
+            self._thread.start()
+
+    def stop(self):
+        """Final flush on shutdown."""
+        self.flush()
+
+    def state(self) -> dict:
+        with self._lock:
+            depth = {table: len(rows) for table, rows in self._buffers.items() if rows}
+        return {
+            "running": self._thread is not None,
+            "depth": depth,
+            "written": self.written,
+            "spilled": self.spilled,
+            "dead": self.dead,
+            "failed_flushes": self.failed_flushes,
+            "spill_file": os.path.exists(self.spill_path),
+            "dead_file": os.path.exists(self.dead_path),
+        }
+
+
+audit_log = AuditLogWriter()
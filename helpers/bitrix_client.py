@@ -0,0 +1,298 @@
+# helpers/bitrix_client.py
+"""
+Single entry point for every Bitrix24 REST call.
+
+One pooled keep-alive session is shared by all routes and helpers, so we
+pay the TCP+TLS handshake once per connection instead of once per call.
+Requests are paced by the process-wide rate governor.
+"""
+import os
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import BITRIX_WEBHOOK
+from helpers.bitrix_rate_limiter import BitrixRateLimited, rate_governor
+from helpers.lead_cache import lead_cache
+from helpers.own_activities import own_activities
+
+BITRIX_POOL_SIZE = int(os.getenv("BITRIX_POOL_SIZE", "20"))
+BITRIX_MAX_RETRIES = int(os.getenv("BITRIX_MAX_RETRIES", "2"))
+BITRIX_CONNECT_TIMEOUT = 3.05
+
+# Read timeout (seconds) per REST method; anything else uses the default.
+DEFAULT_TIMEOUT = 10
+METHOD_TIMEOUTS = {
+    "crm.lead.list": 20,
+    "crm.deal.list": 20,
+    "crm.activity.add": 20,
+    "batch": 30,
+}
+
+# Bitrix rejects batch calls carrying more than 50 commands.
+BATCH_MAX_COMMANDS = 50
+# Fixed page size of every *.list method.
+LIST_PAGE_SIZE = 50
+
+
+def _build_session() -> requests.Session:
+    # Only connect errors and gateway statuses are retried here. Read timeouts
+    # are not, because the portal may already have applied a write. 503s are
+    # left to _request, which can tell QUERY_LIMIT_EXCEEDED apart. Gateway
+    # statuses are retried for GET only: a 502/504 on a POST may come after
+    # the portal applied it (comment.add, activity.add are not idempotent).
+    retry = Retry(
+        total=BITRIX_MAX_RETRIES,
+        connect=BITRIX_MAX_RETRIES,
+        read=0,
+        status=BITRIX_MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=BITRIX_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = _build_session()
+
+
+def bitrix_url(method: str) -> str:
+    return f"{BITRIX_WEBHOOK}{method}.json"
+
+
+def method_timeout(method: str, timeout: float | None = None):
+    read_timeout = timeout or METHOD_TIMEOUTS.get(method, DEFAULT_TIMEOUT)
+    return (BITRIX_CONNECT_TIMEOUT, read_timeout)
+
+
+def _invalidate_written_lead(method: str, params: dict | None):
+    if method == "crm.lead.update" and params and params.get("id"):
+        lead_cache.invalidate(params["id"])
+
+
+def _request(http_method: str, method: str, timeout: float | None = None, **kwargs) -> requests.Response:
+    _invalidate_written_lead(method, kwargs.get("json") or kwargs.get("params"))
+
+    # Every call is paced by the shared governor; rate-limit rejections are
+    # retried here once the governor allows the next request. A long
+    # OPERATION_TIME_LIMIT block raises BitrixRateLimited (first attempt) or
+    # returns the rejection (retries) rather than sleeping on a pool thread.
+    resp = None
+    for attempt in range(BITRIX_MAX_RETRIES + 1):
+        try:
+            rate_governor.acquire(method)
+        except BitrixRateLimited:
+            if resp is None:
+                raise
+            return resp
+        resp = _session.request(
+            http_method,
+            bitrix_url(method),
+            timeout=method_timeout(method, timeout),
+            **kwargs,
+        )
+        try:
+            body = resp.json()
+        except ValueError:
+            return resp
+
+        if not rate_governor.observe(method, body) or attempt == BITRIX_MAX_RETRIES:
+            if method == "crm.activity.add":
+                own_activities.add(body.get("result"))
+            return resp
+
+        print(f"⏳ Bitrix rate limit hit on {method}: {body.get('error')} — retrying")
+    return resp
+
+
+def bitrix_get(method: str, params: dict | None = None, timeout: float | None = None) -> requests.Response:
+    """GET a Bitrix REST method, e.g. bitrix_get("crm.lead.get", {"id": 1})."""
+    return _request("GET", method, timeout=timeout, params=params)
+
+
+def bitrix_post(method: str, json: dict | None = None, timeout: float | None = None) -> requests.Response:
+    """POST a JSON body to a Bitrix REST method."""
+    return _request("POST", method, timeout=timeout, json=json)
+
+
+def get_lead(lead_id, fresh: bool = False) -> dict:
+    """
+    Read-through crm.lead.get. Returns {} when the lead cannot be fetched.
+    Callers must not mutate the returned dict; it is shared via the cache.
+    """
+    if not lead_id:
+        return {}
+
+    if not fresh:
+        cached = lead_cache.get(lead_id)
+        if cached is not None:
+            return cached
+
+    resp = bitrix_get("crm.lead.get", params={"id": lead_id})
+    if not resp.ok:
+        print(f"❌ crm.lead.get failed for lead {lead_id}:", resp.text)
+        return {}
+
+    lead = resp.json().get("result") or {}
+    if lead:
+        lead_cache.put(lead_id, lead)
+    return lead
+
+
+def iter_list(
+    method: str,
+    filter: dict | None = None,
+    select: list | None = None,
+    order: dict | None = None,
+    limit: int | None = None,
+):
+    """
+    Lazily yield rows of a Bitrix *.list method across all pages, stopping
+    as soon as `limit` rows have been yielded.
+
+    Without `order`, pages are walked by ID keyset (`>ID` + start=-1), which
+    skips the total count query and is stable while callers modify rows
+    that then drop out of the filter. With `order`, the `next` cursor is
+    followed instead.
+    """
+    if limit is not None and limit <= 0:
+        return
+
+    filter = dict(filter or {})
+    yielded = 0
+    keyset = order is None
+    last_id = 0
+    start = 0
+
+    while True:
+        payload = {"filter": filter, "select": select or ["*"]}
+        if keyset:
+            payload["filter"][">ID"] = last_id
+            payload["order"] = {"ID": "ASC"}
+            payload["start"] = -1
+        else:
+            payload["order"] = order
+            payload["start"] = start
+
+        resp = bitrix_post(method, json=payload)
+        if not resp.ok:
+            print(f"❌ {method} page failed:", resp.text)
+            return
+
+        body = resp.json()
+        rows = body.get("result") or []
+        for row in rows:
+            yield row
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+
+        if keyset:
+            if len(rows) < LIST_PAGE_SIZE:
+                return
+            last_id = int(rows[-1]["ID"])
+        else:
+            start = body.get("next")
+            if start is None:
+                return
+
+
+def _flatten_params(value, prefix: str):
+    # PHP-style nesting: {"fields": {"A": 1}} -> fields[A]=1
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten_params(item, f"{prefix}[{key}]")
+    elif isinstance(value, (list, tuple)):
+        for idx, item in enumerate(value):
+            yield from _flatten_params(item, f"{prefix}[{idx}]")
+    else:
+        yield prefix, "" if value is None else str(value)
+
+
+def build_query(params: dict | None) -> str:
+    pairs = []
+    for key, value in (params or {}).items():
+        pairs.extend(_flatten_params(value, key))
+    return urlencode(pairs)
+
+
+class BitrixBatch:
+    """
+    Collects REST commands during one request and sends them through the
+    `batch` endpoint, at most BATCH_MAX_COMMANDS per round trip.
+
+        batch = BitrixBatch()
+        key = batch.add("crm.timeline.comment.add", {"fields": {...}})
+        batch.execute()
+        batch.result(key), batch.error(key)
+    """
+
+    def __init__(self, halt: bool = False):
+        self.halt = halt
+        self._commands: dict[str, tuple[str, dict]] = {}
+        self._seq = 0
+        self.results: dict = {}
+        self.errors: dict = {}
+
+    def __len__(self):
+        return len(self._commands)
+
+    def add(self, method: str, params: dict | None = None, key: str | None = None) -> str:
+        if key is None:
+            key = f"cmd{self._seq}"
+            self._seq += 1
+        self._commands[key] = (method, params or {})
+        _invalidate_written_lead(method, params)
+        return key
+
+    def result(self, key: str):
+        return self.results.get(key)
+
+    def error(self, key: str):
+        return self.errors.get(key)
+
+    def execute(self) -> dict:
+        """Send all queued commands; returns {key: result} for successful ones."""
+        items = list(self._commands.items())
+        self._commands = {}
+
+        for start in range(0, len(items), BATCH_MAX_COMMANDS):
+            chunk = items[start:start + BATCH_MAX_COMMANDS]
+            cmd = {
+                key: f"{method}?{build_query(params)}"
+                for key, (method, params) in chunk
+            }
+
+            try:
+                resp = bitrix_post("batch", json={"halt": 1 if self.halt else 0, "cmd": cmd})
+                body = resp.json().get("result") or {}
+            except Exception as e:
+                print("❌ Bitrix batch error:", e)
+                for key, _ in chunk:
+                    self.errors[key] = str(e)
+                continue
+
+            # Bitrix returns [] instead of {} when a section is empty
+            results = body.get("result") or {}
+            self.results.update(results)
+            self.errors.update(body.get("result_error") or {})
+
+            for key, (method, _) in chunk:
+                if method == "crm.activity.add" and key in results:
+                    own_activities.add(results[key])
+
+        if self.errors:
+            print("⚠️ Bitrix batch command errors:", self.errors)
+
+        return self.results
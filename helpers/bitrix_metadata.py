@@ -0,0 +1,140 @@
+# helpers/bitrix_metadata.py
+"""
+In-memory registry of Bitrix metadata: status lists (lead statuses and
+deal stages of every pipeline), deal categories and crm.lead.fields.
+
+Loaded once at startup with a single batch call and refreshed in a
+background thread, so stage/status lookups are plain dict reads.
+"""
+import os
+import threading
+import time
+
+from helpers.bitrix_client import BitrixBatch
+
+METADATA_REFRESH_SECONDS = int(os.getenv("BITRIX_METADATA_REFRESH_SECONDS", "900"))
+
+# ---------------- Portal-specific IDs used by the call flows ----------------
+
+LEAD_STATUS_ENTITY = "STATUS"
+LEAD_STATUS_PROCESSED = "PROCESSED"
+LEAD_STATUS_JUNK = "JUNK"
+LEAD_STATUS_CONVERTED = "CONVERTED"
+LEAD_STATUS_UNANSWERED = "14"   # triggers the "Unanswered" automation
+
+DEAL_JUNK_STAGE_ID = "LOSE"  # 🔴 CHANGE if needed
+DEAL_STAGE_BY_HOTNESS = {
+    "COLD": "4",
+    "WARM": "6",
+    "HOT": "8",
+}
+
+
+def deal_stage_entity(category_id) -> str:
+    if category_id and str(category_id) != "0":
+        return f"DEAL_STAGE_{category_id}"
+    return "DEAL_STAGE"
+
+
+class BitrixMetadata:
+    def __init__(self):
+        self._statuses: dict[tuple[str, str], dict] = {}
+        self._by_entity: dict[str, list[dict]] = {}
+        self.deal_categories: dict[str, dict] = {}
+        self.lead_fields: dict[str, dict] = {}
+        self.loaded_at: float | None = None
+
+        self._lock = threading.Lock()
+        self._refresh_thread: threading.Thread | None = None
+
+    # ---------------- loading ----------------
+
+    def refresh(self) -> bool:
+        batch = BitrixBatch()
+        batch.add("crm.status.list", {"order": {"SORT": "ASC"}}, key="statuses")
+        batch.add("crm.dealcategory.list", {}, key="deal_categories")
+        batch.add("crm.lead.fields", {}, key="lead_fields")
+        batch.execute()
+
+        statuses = batch.result("statuses")
+        if not statuses:
+            print("⚠️ Bitrix metadata refresh failed:", batch.errors)
+            return False
+
+        by_key = {}
+        by_entity = {}
+        for row in statuses:
+            by_key[(row.get("ENTITY_ID"), row.get("STATUS_ID"))] = row
+            by_entity.setdefault(row.get("ENTITY_ID"), []).append(row)
+
+        categories = {str(c.get("ID")): c for c in (batch.result("deal_categories") or [])}
+
+        with self._lock:
+            self._statuses = by_key
+            self._by_entity = by_entity
+            self.deal_categories = categories
+            self.lead_fields = batch.result("lead_fields") or self.lead_fields
+            self.loaded_at = time.time()
+
+        self._check_known_ids()
+        print(f"📚 Bitrix metadata loaded: {len(by_key)} statuses, {len(categories)} deal categories")
+        return True
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            self.refresh()
+
+    def _check_known_ids(self):
+        expected = [(LEAD_STATUS_ENTITY, LEAD_STATUS_UNANSWERED), (deal_stage_entity(None), DEAL_JUNK_STAGE_ID)]
+        expected += [(deal_stage_entity(None), stage) for stage in DEAL_STAGE_BY_HOTNESS.values()]
+        for entity_id, status_id in expected:
+            if (entity_id, status_id) not in self._statuses:
+                print(f"⚠️ Bitrix metadata: {entity_id}/{status_id} not found on portal")
+
+    def _refresh_loop(self, interval: int):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print("❌ Bitrix metadata refresh error:", e)
+
+    def start_background_refresh(self, interval: int = METADATA_REFRESH_SECONDS):
+        """Load now and keep refreshing in a daemon thread."""
+        try:
+            self.refresh()
+        except Exception as e:
+            print("❌ Bitrix metadata initial load error:", e)
+
+        if self._refresh_thread is None:
+            self._refresh_thread = threading.Thread(
+                target=self._refresh_loop, args=(interval,), daemon=True, name="bitrix-metadata"
+            )
+            self._refresh_thread.start()
+
+    # ---------------- lookups ----------------
+
+    def status(self, entity_id: str, status_id) -> dict | None:
+        return self._statuses.get((entity_id, str(status_id)))
+
+    def statuses(self, entity_id: str) -> list[dict]:
+        return list(self._by_entity.get(entity_id, []))
+
+    def stage_semantics(self, stage_id, category_id=None) -> str | None:
+        row = self.status(deal_stage_entity(category_id), stage_id)
+        return row.get("SEMANTICS") if row else None
+
+    def lead_field(self, field_id: str) -> dict | None:
+        return self.lead_fields.get(field_id)
+
+    def state(self) -> dict:
+        return {
+            "loaded_at": self.loaded_at,
+            "statuses": len(self._statuses),
+            "entities": sorted(self._by_entity),
+            "deal_categories": len(self.deal_categories),
+            "lead_fields": len(self.lead_fields),
+        }
+
+
+bitrix_metadata = BitrixMetadata()
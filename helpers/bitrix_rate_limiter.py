@@ -0,0 +1,201 @@
+# helpers/bitrix_rate_limiter.py
+"""
+Process-wide pacing for Bitrix REST calls.
+
+Bitrix webhooks are throttled twice:
+  - a leaky bucket of ~2 requests/second (QUERY_LIMIT_EXCEEDED), and
+  - an "operating time" budget per method (time.operating in every
+    response, reset at time.operating_reset_at).
+
+BitrixRateGovernor is a token bucket that slows itself down as the portal
+reports rising operating time, so we back off before being rejected.
+
+The bucket lives in one process, but the portal budget is shared by every
+process using the webhook (the web app's workers and process_retries.py).
+BITRIX_PORTAL_RATE_PER_SEC / BITRIX_PORTAL_BURST describe the portal and
+are divided by BITRIX_PROCESSES, the number of processes sharing it;
+BITRIX_RATE_PER_SEC / BITRIX_BURST override the per-process share.
+"""
+import os
+import threading
+import time
+
+BITRIX_PORTAL_RATE_PER_SEC = float(os.getenv("BITRIX_PORTAL_RATE_PER_SEC", "2"))
+BITRIX_PORTAL_BURST = int(os.getenv("BITRIX_PORTAL_BURST", "10"))
+# Web app + retry worker by default; count every uvicorn worker separately
+BITRIX_PROCESSES = max(1, int(os.getenv("BITRIX_PROCESSES", "2")))
+BITRIX_RATE_PER_SEC = float(os.getenv("BITRIX_RATE_PER_SEC", BITRIX_PORTAL_RATE_PER_SEC / BITRIX_PROCESSES))
+BITRIX_BURST = int(os.getenv("BITRIX_BURST", max(1, BITRIX_PORTAL_BURST // BITRIX_PROCESSES)))
+
+# Bitrix allows 480s of operating time per method in a 10 minute window.
+OPERATING_LIMIT_SECONDS = 480
+# Start slowing down once a method has used this share of its budget.
+OPERATING_SLOWDOWN_AT = 0.5
+# Never pace slower than this share of the base rate.
+MIN_RATE_FACTOR = 0.1
+# Pause after the portal rejects us with QUERY_LIMIT_EXCEEDED.
+LIMIT_EXCEEDED_PAUSE = 2.0
+# Longest a caller may be held in acquire(). A method blocked for longer
+# (OPERATION_TIME_LIMIT can last minutes) fails fast instead of pinning a
+# blocking-pool thread.
+BITRIX_MAX_WAIT_SECONDS = float(os.getenv("BITRIX_MAX_WAIT_SECONDS", "10"))
+
+
+class BitrixRateLimited(RuntimeError):
+    """The method is blocked by Bitrix for longer than BITRIX_MAX_WAIT_SECONDS."""
+
+    def __init__(self, method: str | None, retry_after: float):
+        super().__init__(f"Bitrix method {method} blocked for {retry_after:.0f}s (OPERATION_TIME_LIMIT)")
+        self.method = method
+        self.retry_after = retry_after
+
+
+class BitrixRateGovernor:
+    def __init__(self, rate: float = BITRIX_RATE_PER_SEC, burst: int = BITRIX_BURST):
+        self.base_rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+        # method -> (operating seconds, operating_reset_at epoch)
+        self._operating: dict[str, tuple[float, float]] = {}
+        self._method_blocked_until: dict[str, float] = {}
+
+        self.requests = 0
+        self.waited_seconds = 0.0
+        self.limit_exceeded = 0
+
+    # ---------------- pacing ----------------
+
+    def current_rate(self) -> float:
+        now = time.time()
+        worst = 0.0
+        for operating, reset_at in self._operating.values():
+            if reset_at and reset_at <= now:
+                continue
+            worst = max(worst, operating / OPERATING_LIMIT_SECONDS)
+
+        if worst <= OPERATING_SLOWDOWN_AT:
+            return self.base_rate
+
+        factor = 1 - (worst - OPERATING_SLOWDOWN_AT) / (1 - OPERATING_SLOWDOWN_AT)
+        return self.base_rate * max(MIN_RATE_FACTOR, factor)
+
+    def _refill(self, now: float, rate: float):
+        elapsed = now - self._last_refill
+        self._tokens = min(self.burst, self._tokens + elapsed * rate)
+        self._last_refill = now
+
+    def acquire(self, method: str | None = None, max_wait: float = BITRIX_MAX_WAIT_SECONDS):
+        """
+        Block until a request to `method` may be sent. Raises
+        BitrixRateLimited instead of waiting longer than `max_wait`.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                rate = self.current_rate()
+                self._refill(now, rate)
+
+                wait = max(0.0, self._paused_until - now)
+                blocked_until = self._method_blocked_until.get(method)
+                if blocked_until:
+                    wall_wait = blocked_until - time.time()
+                    if wall_wait > max_wait:
+                        raise BitrixRateLimited(method, wall_wait)
+                    if wall_wait > 0:
+                        wait = max(wait, wall_wait)
+                    else:
+                        self._method_blocked_until.pop(method, None)
+
+                if wait == 0.0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests += 1
+                        self.waited_seconds += waited
+                        return
+                    wait = (1 - self._tokens) / rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def ensure_available(self, *methods: str, max_wait: float = BITRIX_MAX_WAIT_SECONDS):
+        """
+        Raise BitrixRateLimited now if any of `methods` is blocked for longer
+        than max_wait, so a handler fails before it writes anything rather
+        than half-way through (a redelivery would repeat the writes).
+        """
+        now = time.time()
+        with self._lock:
+            for method in methods:
+                wait = self._method_blocked_until.get(method, 0.0) - now
+                if wait > max_wait:
+                    raise BitrixRateLimited(method, wait)
+
+    # ---------------- feedback ----------------
+
+    def observe(self, method: str, body: dict | None) -> bool:
+        """
+        Feed a Bitrix response body back into the governor.
+        Returns True when the portal rejected the call for rate limiting,
+        i.e. the caller should retry after the next acquire().
+        """
+        if not isinstance(body, dict):
+            return False
+
+        timing = body.get("time") or {}
+        operating = timing.get("operating")
+        reset_at = timing.get("operating_reset_at")
+
+        with self._lock:
+            if operating is not None:
+                self._operating[method] = (float(operating), float(reset_at or 0))
+
+            error = body.get("error")
+            if error == "QUERY_LIMIT_EXCEEDED":
+                self.limit_exceeded += 1
+                self._tokens = 0.0
+                self._paused_until = time.monotonic() + LIMIT_EXCEEDED_PAUSE
+                return True
+
+            if error == "OPERATION_TIME_LIMIT":
+                self.limit_exceeded += 1
+                blocked_until = float(reset_at or time.time() + 60)
+                self._method_blocked_until[method] = blocked_until
+                return True
+
+        return False
+
+    def state(self) -> dict:
+        with self._lock:
+            now = time.time()
+            return {
+                "base_rate_per_sec": self.base_rate,
+                "portal_rate_per_sec": BITRIX_PORTAL_RATE_PER_SEC,
+                "processes": BITRIX_PROCESSES,
+                "current_rate_per_sec": round(self.current_rate(), 3),
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "paused_for_sec": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                "requests": self.requests,
+                "waited_seconds": round(self.waited_seconds, 2),
+                "limit_exceeded": self.limit_exceeded,
+                "operating": {
+                    method: {"operating": operating, "reset_at": reset_at}
+                    for method, (operating, reset_at) in self._operating.items()
+                    if not reset_at or reset_at > now
+                },
+                "blocked_methods": {
+                    method: until
+                    for method, until in self._method_blocked_until.items()
+                    if until > now
+                },
+            }
+
+
+# One governor per process: its webhooks and retry paths share it; other
+# processes get their own share of the portal budget (BITRIX_PROCESSES).
+rate_governor = BitrixRateGovernor()
@@ -0,0 +1,49 @@
+# helpers/blocking.py
+"""
+Bounded thread pool for the synchronous I/O stack (requests + supabase).
+
+Route handlers stay `async def` but hand their blocking work to
+run_blocking, so one slow Bitrix or Supabase response never freezes the
+other in-flight webhooks on the worker. Sync code already running in the
+pool can call back into the event loop with run_async.
+"""
+import functools
+import os
+
+from anyio import CapacityLimiter, from_thread, to_thread
+
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "40"))
+
+_limiter: CapacityLimiter | None = None
+
+
+def _get_limiter() -> CapacityLimiter:
+    # Created lazily: anyio needs a running event loop to build it
+    global _limiter
+    if _limiter is None:
+        _limiter = CapacityLimiter(BLOCKING_IO_THREADS)
+    return _limiter
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the bounded pool and await its result."""
+    return await to_thread.run_sync(
+        functools.partial(func, *args, **kwargs),
+        limiter=_get_limiter(),
+    )
+
+
+def run_async(async_func, *args):
+    """From a run_blocking thread, run a coroutine on the event loop and wait for it."""
+    return from_thread.run(async_func, *args)
+
+
+def blocking_pool_state() -> dict:
+    if _limiter is None:
+        return {"threads": BLOCKING_IO_THREADS, "busy": 0, "waiting": 0}
+    stats = _limiter.statistics()
+    return {
+        "threads": BLOCKING_IO_THREADS,
+        "busy": stats.borrowed_tokens,
+        "waiting": stats.tasks_waiting,
+    }
@@ -0,0 +1,223 @@
+# helpers/calling_calendar.py
+"""
+Calling calendar: when retry calls are allowed.
+
+Daily windows, weekly blackouts and holidays are compiled once into a
+sorted table of open intervals (epoch seconds). "Is t open?" and "next
+open instant >= t" are then a single bisect, with no timezone work per
+call.
+
+The table is one immutable (starts, ends, from, to) tuple: compile()
+swaps it in with a single assignment and every lookup reads it into a
+local once, so readers never mix two compilations.
+
+Configuration (IST):
+  CALL_WINDOW_START / CALL_WINDOW_END   daily window, default 09:00–18:00
+  CALL_BLACKOUTS                        weekday@HH:MM-HH:MM, comma separated;
+                                        default Sunday 10:00–12:00
+  CALL_BLACKOUT_RESUME_MINUTES          calls held by a blackout resume this
+                                        long after it ends (default 1: 12:01)
+  CALL_HOLIDAYS                         YYYY-MM-DD dates with no calls
+  CALENDAR_MAX_LOOKAHEAD_DAYS           give up (RuntimeError) when nothing
+                                        is open this far ahead
+"""
+import bisect
+import os
+from datetime import date, datetime, time as dtime, timedelta, timezone
+
+# IST has no DST: a fixed offset avoids pytz localize() on every call
+IST = timezone(timedelta(hours=5, minutes=30), "IST")
+
+CALL_WINDOW_START = os.getenv("CALL_WINDOW_START", "09:00")
+CALL_WINDOW_END = os.getenv("CALL_WINDOW_END", "18:00")
+CALL_BLACKOUTS = os.getenv("CALL_BLACKOUTS", "6@10:00-12:00")  # weekday(): Monday=0 … Sunday=6
+CALL_BLACKOUT_RESUME_MINUTES = int(os.getenv("CALL_BLACKOUT_RESUME_MINUTES", "1"))
+CALL_HOLIDAYS = os.getenv("CALL_HOLIDAYS", "")
+CALENDAR_HORIZON_DAYS = int(os.getenv("CALENDAR_HORIZON_DAYS", "60"))
+CALENDAR_MAX_LOOKAHEAD_DAYS = int(os.getenv("CALENDAR_MAX_LOOKAHEAD_DAYS", "366"))
+
+
+def _parse_hhmm(value: str) -> dtime:
+    hour, minute = value.strip().split(":")
+    return dtime(int(hour), int(minute))
+
+
+def _parse_blackouts(spec: str) -> dict[int, list[tuple[dtime, dtime]]]:
+    blackouts: dict[int, list[tuple[dtime, dtime]]] = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        weekday, span = item.split("@")
+        start, end = span.split("-")
+        blackouts.setdefault(int(weekday), []).append((_parse_hhmm(start), _parse_hhmm(end)))
+    return blackouts
+
+
+def _parse_holidays(spec: str) -> set[date]:
+    return {date.fromisoformat(d.strip()) for d in spec.split(",") if d.strip()}
+
+
+def _ts(dt: datetime) -> float:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=IST)
+    return dt.timestamp()
+
+
+class CallingCalendar:
+    def __init__(
+        self,
+        window_start: str = CALL_WINDOW_START,
+        window_end: str = CALL_WINDOW_END,
+        blackouts: str = CALL_BLACKOUTS,
+        blackout_resume_minutes: int = CALL_BLACKOUT_RESUME_MINUTES,
+        holidays: str = CALL_HOLIDAYS,
+        horizon_days: int = CALENDAR_HORIZON_DAYS,
+    ):
+        self.window_start = _parse_hhmm(window_start)
+        self.window_end = _parse_hhmm(window_end)
+        self.blackouts = _parse_blackouts(blackouts)
+        self.blackout_resume = blackout_resume_minutes * 60
+        self.holidays = _parse_holidays(holidays)
+        self.horizon_days = horizon_days
+
+        # (starts, ends, from, to), replaced as a whole by compile()
+        self._table: tuple[tuple[float, ...], tuple[float, ...], float, float] = ((), (), 0.0, 0.0)
+
+    # ---------------- compilation ----------------
+
+    def _day_intervals(self, day: date) -> list[tuple[float, float]]:
+        if day in self.holidays:
+            return []
+
+        spans = [(self.window_start, self.window_end)]
+        for b_start, b_end in sorted(self.blackouts.get(day.weekday(), [])):
+            cut = []
+            for s, e in spans:
+                if b_end <= s or b_start >= e:
+                    cut.append((s, e))
+                    continue
+                if s < b_start:
+                    cut.append((s, b_start))
+                if b_end < e:
+                    cut.append((b_end, e))
+            spans = cut
+
+        return [
+            (datetime.combine(day, s, IST).timestamp(), datetime.combine(day, e, IST).timestamp())
+            for s, e in spans
+            if s < e
+        ]
+
+    def _build(self, around: float | None = None) -> tuple:
+        """Interval table from a day before `around` to the horizon."""
+        days = self.horizon_days
+        base = datetime.fromtimestamp(around, IST).date() if around else datetime.now(IST).date()
+        first = base - timedelta(days=1)
+
+        starts, ends = [], []
+        for n in range(days + 1):
+            for s, e in self._day_intervals(first + timedelta(days=n)):
+                starts.append(s)
+                ends.append(e)
+
+        return (
+            tuple(starts),
+            tuple(ends),
+            datetime.combine(first, dtime(0), IST).timestamp(),
+            datetime.combine(first + timedelta(days=days), dtime(0), IST).timestamp(),
+        )
+
+    def compile(self, around: float | None = None) -> tuple:
+        """Build and publish the table from a day before `around` to the horizon."""
+        table = self._build(around)
+        self._table = table
+        return table
+
+    def _table_for(self, ts: float) -> tuple:
+        table = self._table
+        if not (table[2] <= ts < table[3]) or not table[0]:
+            table = self.compile(ts)
+        return table
+
+    # ---------------- scalar lookups ----------------
+
+    def _interval_at(self, ts: float) -> float | None:
+        """End of the open interval containing ts, or None."""
+        starts, ends, _, _ = self._table_for(ts)
+        i = bisect.bisect_right(starts, ts) - 1
+        if i >= 0 and ts < ends[i]:
+            return ends[i]
+        return None
+
+    def is_open_ts(self, ts: float) -> bool:
+        return self._interval_at(ts) is not None
+
+    def next_open_ts(self, ts: float) -> float:
+        """Earliest open instant >= ts."""
+        probe, limit = ts, ts + CALENDAR_MAX_LOOKAHEAD_DAYS * 86400
+        while probe < limit:
+            starts, ends, _, to = self._table_for(probe)
+            i = bisect.bisect_right(starts, probe) - 1
+            if i >= 0 and probe < ends[i]:
+                return probe
+            if i + 1 < len(starts):
+                return starts[i + 1]
+            # Nothing open up to the compiled horizon: look past it
+            probe = to
+        raise RuntimeError(
+            f"Calling calendar has no open time within {CALENDAR_MAX_LOOKAHEAD_DAYS} days of "
+            f"{datetime.fromtimestamp(ts, IST):%Y-%m-%d %H:%M} IST; check CALL_WINDOW_START/END, "
+            f"CALL_BLACKOUTS and CALL_HOLIDAYS"
+        )
+
+    def resume_ts(self, ts: float) -> float:
+        """
+        Earliest instant a held call may be placed: next_open_ts, except that
+        inside a blackout it is blackout_resume after the blackout ends
+        (Sunday 10–12 resumes at 12:01).
+        """
+        nxt = self.next_open_ts(ts)
+        if self.blackout_resume and self.in_blackout(datetime.fromtimestamp(ts, IST)):
+            nxt = self.next_open_ts(nxt + self.blackout_resume)
+        return nxt
+
+    def is_open(self, dt: datetime) -> bool:
+        return self.is_open_ts(_ts(dt))
+
+    def next_open(self, dt: datetime) -> datetime:
+        """Earliest open instant >= dt, as an IST datetime (dt itself if open)."""
+        ts = _ts(dt)
+        nxt = self.next_open_ts(ts)
+        if nxt == ts:
+            return dt
+        return datetime.fromtimestamp(nxt, IST)
+
+    def resume_after(self, dt: datetime) -> datetime:
+        """resume_ts for a datetime, as an IST datetime (dt itself if open)."""
+        ts = _ts(dt)
+        nxt = self.resume_ts(ts)
+        if nxt == ts:
+            return dt
+        return datetime.fromtimestamp(nxt, IST)
+
+    def open_until(self, dt: datetime) -> datetime | None:
+        """End of the open interval containing dt."""
+        end = self._interval_at(_ts(dt))
+        if end is None:
+            return None
+        return datetime.fromtimestamp(end, IST)
+
+    def in_blackout(self, dt: datetime) -> bool:
+        """Inside a weekly blackout (holidays and off-hours are not blackouts)."""
+        local = dt.astimezone(IST) if dt.tzinfo else dt
+        t = local.time()
+        return any(s <= t < e for s, e in self.blackouts.get(local.weekday(), []))
+
+    def state(self) -> dict:
+        return {
+            "window": f"{self.window_start:%H:%M}-{self.window_end:%H:%M}",
+            "blackouts": {d: [f"{s:%H:%M}-{e:%H:%M}" for s, e in v] for d, v in self.blackouts.items()},
+            "holidays": sorted(d.isoformat() for d in self.holidays),
+            "intervals": len(self._table[0]),
+        }
+
+
+calling_calendar = CallingCalendar()
@@ -0,0 +1,175 @@
+# helpers/deal_index.py
+"""
+Bidirectional lead <-> deal index.
+
+Kept in memory, persisted to the Supabase `deal_lead_mapping` table, warmed
+from it at startup and kept current by an incremental crm.deal.list sync
+on DATE_MODIFY. find_deal_for_lead and the activity webhook resolve deals
+with a dict lookup and only fall back to Bitrix on a miss.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from dateutil.parser import isoparse
+
+from config import supabase
+from helpers.bitrix_client import bitrix_get, iter_list
+
+DEAL_INDEX_SYNC_SECONDS = int(os.getenv("DEAL_INDEX_SYNC_SECONDS", "60"))
+DEAL_INDEX_LOOKBACK_HOURS = int(os.getenv("DEAL_INDEX_LOOKBACK_HOURS", "24"))
+SUPABASE_PAGE_SIZE = 1000
+
+
+class DealIndex:
+    def __init__(self):
+        self._lead_to_deal: dict[str, str] = {}
+        self._deal_to_lead: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._sync_thread: threading.Thread | None = None
+
+        # Bitrix DATE_MODIFY watermark for the incremental sync
+        self.modified_since: datetime | None = None
+        self.last_sync_at: float | None = None
+
+    # ---------------- updates ----------------
+
+    def _remember(self, deal_id: str, lead_id: str) -> bool:
+        """Returns True when the pair was not known yet."""
+        with self._lock:
+            if self._deal_to_lead.get(deal_id) == lead_id:
+                return False
+
+            self._deal_to_lead[deal_id] = lead_id
+            # A lead maps to its newest deal (highest ID)
+            current = self._lead_to_deal.get(lead_id)
+            if current is None or int(deal_id) > int(current):
+                self._lead_to_deal[lead_id] = deal_id
+            return True
+
+    def record(self, deal_id, lead_id, persist: bool = True):
+        if not deal_id or not lead_id:
+            return
+
+        deal_id, lead_id = str(deal_id), str(lead_id)
+        if self._remember(deal_id, lead_id) and persist:
+            self._persist([{"deal_id": deal_id, "lead_id": lead_id}])
+
+    def _persist(self, rows: list[dict]):
+        try:
+            supabase.table("deal_lead_mapping").upsert(rows, on_conflict="deal_id").execute()
+        except Exception as e:
+            print("❌ deal_lead_mapping upsert error:", e)
+
+    # ---------------- lookups ----------------
+
+    def deal_for_lead(self, lead_id) -> str | None:
+        return self._lead_to_deal.get(str(lead_id))
+
+    def lead_for_deal(self, deal_id) -> str | None:
+        return self._deal_to_lead.get(str(deal_id))
+
+    def resolve_lead_for_deal(self, deal_id) -> str | None:
+        """Index lookup, falling back to crm.deal.get on a miss."""
+        if not deal_id:
+            return None
+
+        lead_id = self.lead_for_deal(deal_id)
+        if lead_id:
+            return lead_id
+
+        try:
+            res = bitrix_get("crm.deal.get", params={"id": deal_id})
+            lead_id = (res.json().get("result") or {}).get("LEAD_ID")
+        except Exception as e:
+            print("⚠️ crm.deal.get fallback error:", e)
+            return None
+
+        self.record(deal_id, lead_id)
+        return str(lead_id) if lead_id else None
+
+    # ---------------- warm-up / sync ----------------
+
+    def warm_from_supabase(self):
+        offset = 0
+        loaded = 0
+        while True:
+            res = (supabase.table("deal_lead_mapping")
+                   .select("deal_id,lead_id")
+                   .range(offset, offset + SUPABASE_PAGE_SIZE - 1)
+                   .execute())
+            rows = res.data or []
+            for row in rows:
+                if row.get("deal_id") and row.get("lead_id"):
+                    self._remember(str(row["deal_id"]), str(row["lead_id"]))
+            loaded += len(rows)
+            if len(rows) < SUPABASE_PAGE_SIZE:
+                break
+            offset += SUPABASE_PAGE_SIZE
+
+        print(f"📇 Deal index warmed from Supabase: {loaded} mappings")
+
+    def sync_from_bitrix(self) -> int:
+        """Pull deals modified since the watermark; returns new pairs found."""
+        if self.modified_since is None:
+            self.modified_since = datetime.now(timezone.utc) - timedelta(hours=DEAL_INDEX_LOOKBACK_HOURS)
+
+        # Page against a fixed watermark; ">=" because DATE_MODIFY has
+        # one-second resolution and re-seeing a known pair is a no-op.
+        since = self.modified_since
+        newest = since
+        new_rows = []
+        deals = iter_list(
+            "crm.deal.list",
+            filter={">=DATE_MODIFY": since.isoformat(), "!LEAD_ID": ""},
+            select=["ID", "LEAD_ID", "DATE_MODIFY"],
+            order={"DATE_MODIFY": "ASC"},
+        )
+        for deal in deals:
+            deal_id, lead_id = str(deal["ID"]), deal.get("LEAD_ID")
+            if lead_id and self._remember(deal_id, str(lead_id)):
+                new_rows.append({"deal_id": deal_id, "lead_id": str(lead_id)})
+            if deal.get("DATE_MODIFY"):
+                newest = max(newest, isoparse(deal["DATE_MODIFY"]))
+
+        self.modified_since = newest
+
+        if new_rows:
+            self._persist(new_rows)
+
+        self.last_sync_at = time.time()
+        return len(new_rows)
+
+    def _sync_loop(self, interval: int):
+        while True:
+            try:
+                found = self.sync_from_bitrix()
+                if found:
+                    print(f"📇 Deal index sync: {found} new lead↔deal pairs")
+            except Exception as e:
+                print("❌ Deal index sync error:", e)
+            time.sleep(interval)
+
+    def start_background_sync(self, interval: int = DEAL_INDEX_SYNC_SECONDS):
+        try:
+            self.warm_from_supabase()
+        except Exception as e:
+            print("❌ Deal index warm-up error:", e)
+
+        if self._sync_thread is None:
+            self._sync_thread = threading.Thread(
+                target=self._sync_loop, args=(interval,), daemon=True, name="deal-index-sync"
+            )
+            self._sync_thread.start()
+
+    def state(self) -> dict:
+        return {
+            "leads": len(self._lead_to_deal),
+            "deals": len(self._deal_to_lead),
+            "modified_since": self.modified_since.isoformat() if self.modified_since else None,
+            "last_sync_at": self.last_sync_at,
+        }
+
+
+deal_index = DealIndex()
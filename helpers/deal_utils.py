@@ -1,11 +1,14 @@
 import os
 from fastapi import Request
-import requests
-from config import BITRIX_WEBHOOK
+from helpers.bitrix_client import bitrix_get, bitrix_post
+from helpers.bitrix_metadata import bitrix_metadata
+from helpers.deal_index import deal_index
 
 def get_deal_stage_semantics(deal_id):
-    url = f"{BITRIX_WEBHOOK}crm.deal.get.json"
-    response = requests.get(url, params={"id": deal_id},timeout=10)
+    if not deal_id:
+        return None
+
+    response = bitrix_get("crm.deal.get", params={"id": deal_id})
     result = response.json().get("result", {})
 
     stage_id = result.get("STAGE_ID")
@@ -14,24 +17,9 @@ def get_deal_stage_semantics(deal_id):
     if not stage_id:
         return None
 
-    # Fetch stage details
-    payload = {
-        "filter": {
-            "ENTITY_ID": f"DEAL_STAGE_{category_id}" if category_id else "DEAL_STAGE",
-            "STATUS_ID": stage_id
-        }
-    }
-    res = requests.post(
-        f"{BITRIX_WEBHOOK}crm.status.list.json",
-        json=payload
-    )
-
-    stage_list = res.json().get("result", [])
-
-    if stage_list:
-        return stage_list[0].get("SEMANTICS")  # process / success / failure
-    
-    return None
+    # Stage details come from the in-memory metadata registry
+    bitrix_metadata.ensure_loaded()
+    return bitrix_metadata.stage_semantics(stage_id, category_id)  # process / success / failure
 
 
 
@@ -39,7 +27,10 @@ def get_deal_stage_semantics(deal_id):
 
 
 def find_deal_for_lead(lead_id):
-    url = f"{BITRIX_WEBHOOK}crm.deal.list.json"
+    # Local lead↔deal index first; Bitrix only on a miss
+    deal_id = deal_index.deal_for_lead(lead_id)
+    if deal_id:
+        return deal_id
 
     payload = {
         "filter": {"LEAD_ID": lead_id},
@@ -47,10 +38,11 @@ def find_deal_for_lead(lead_id):
         "order": {"ID": "DESC"}   # get newest deal
     }
 
-    res = requests.post(url, json=payload)
+    res = bitrix_post("crm.deal.list", json=payload)
     deals = res.json().get("result", [])
 
     if deals:
+        deal_index.record(deals[0]["ID"], lead_id)
         return deals[0]["ID"]   # newest deal
 
     return None
@@ -0,0 +1,77 @@
+# helpers/deal_waiter.py
+"""
+Wait for Bitrix automation to create the deal of a lead without blocking
+the event loop.
+
+Waiters are resolved by the ONCRMDEALADD webhook (notify_deal_created) the
+moment the deal exists; a short polling fallback with exponential backoff
+covers portals where the event is not delivered.
+"""
+import asyncio
+import os
+import threading
+
+from helpers.deal_utils import find_deal_for_lead
+
+DEAL_WAIT_TIMEOUT = float(os.getenv("DEAL_WAIT_TIMEOUT", "10"))
+DEAL_POLL_INITIAL = 0.5
+DEAL_POLL_MAX = 2.0
+
+_waiters: dict[str, list[tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+_lock = threading.Lock()
+
+
+def _resolve(fut: asyncio.Future, deal_id: str):
+    if not fut.done():
+        fut.set_result(deal_id)
+
+
+def notify_deal_created(lead_id, deal_id) -> int:
+    """Resolve everyone waiting on this lead's deal. Safe from any thread."""
+    with _lock:
+        waiters = _waiters.pop(str(lead_id), [])
+
+    for loop, fut in waiters:
+        loop.call_soon_threadsafe(_resolve, fut, str(deal_id))
+    return len(waiters)
+
+
+async def wait_for_deal(lead_id, timeout: float = DEAL_WAIT_TIMEOUT) -> str | None:
+    """Return the lead's deal id as soon as it exists, or None after `timeout`."""
+    key = str(lead_id)
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+
+    with _lock:
+        _waiters.setdefault(key, []).append((loop, fut))
+
+    try:
+        deadline = loop.time() + timeout
+        delay = DEAL_POLL_INITIAL
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+
+            try:
+                return await asyncio.wait_for(asyncio.shield(fut), timeout=min(delay, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+            # Fallback: the deal event may never arrive. Uses the default
+            # executor, not run_blocking: the waiting caller may itself hold
+            # a run_blocking slot, and a full pool must not starve the poll.
+            deal_id = await asyncio.to_thread(find_deal_for_lead, lead_id)
+            if deal_id:
+                return deal_id
+
+            delay = min(delay * 2, DEAL_POLL_MAX)
+    finally:
+        with _lock:
+            waiters = _waiters.get(key, [])
+            if (loop, fut) in waiters:
+                waiters.remove((loop, fut))
+            if not waiters:
+                _waiters.pop(key, None)
+        fut.cancel()
@@ -0,0 +1,141 @@
+# helpers/dial_engine.py
+"""
+Concurrent dispatch for the retry queue.
+
+process_due_retries hands its due rows to dial_engine.run(), which works
+through them on a thread pool (DIAL_WORKERS). Rows of the same lead run in
+order on one worker. Every Bolna POST goes through dial_engine.slot(),
+which caps concurrent calls per agent and per caller ID, so a large
+backlog does not flood one agent or number.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from helpers.logger import logger
+
+DIAL_WORKERS = int(os.getenv("DIAL_WORKERS", "8"))
+DIAL_PER_AGENT_CAP = int(os.getenv("DIAL_PER_AGENT_CAP", "5"))
+DIAL_PER_CALLER_CAP = int(os.getenv("DIAL_PER_CALLER_CAP", "5"))
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class DialEngine:
+    def __init__(
+        self,
+        workers: int = DIAL_WORKERS,
+        per_agent_cap: int = DIAL_PER_AGENT_CAP,
+        per_caller_cap: int = DIAL_PER_CALLER_CAP,
+    ):
+        self.workers = workers
+        self.per_agent_cap = per_agent_cap
+        self.per_caller_cap = per_caller_cap
+
+        self._agent_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._caller_slots: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+        self._dial_latencies: list[float] = []
+        self.in_flight = 0
+        self.last_tick: dict = {}
+
+    def _semaphore(self, table: dict, key: str, cap: int) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = table.get(key)
+            if sem is None:
+                sem = table[key] = threading.BoundedSemaphore(cap)
+            return sem
+
+    @contextmanager
+    def slot(self, agent_id: str, caller_id: str):
+        """Hold one agent slot and one caller-ID slot for the duration of a dial."""
+        agent_sem = self._semaphore(self._agent_slots, agent_id or "", self.per_agent_cap)
+        caller_sem = self._semaphore(self._caller_slots, caller_id or "", self.per_caller_cap)
+
+        # Always agent first, then caller ID: a fixed order cannot deadlock
+        with agent_sem, caller_sem:
+            with self._lock:
+                self.in_flight += 1
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self.in_flight -= 1
+                    self._dial_latencies.append(elapsed)
+
+    def run(self, rows, handler, key=lambda r: r.get("lead_id")) -> list:
+        """
+        Run handler(row) for every row and collect the non-None results.
+        Rows sharing a key (lead) are processed in order, one at a time.
+        """
+        by_lead: OrderedDict = OrderedDict()
+        for row in rows:
+            by_lead.setdefault(key(row), []).append(row)
+
+        with self._lock:
+            self._dial_latencies = []
+
+        def run_lead(lead_rows):
+            out, errors = [], 0
+            for row in lead_rows:
+                try:
+                    result = handler(row)
+                    if result is not None:
+                        out.append(result)
+                except Exception:
+                    errors += 1
+                    logger.exception(f"🔥 Dial handler failed for lead {key(row)}")
+            return out, errors
+
+        started = time.monotonic()
+        results, errors = [], 0
+
+        if by_lead:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dial") as pool:
+                futures = [pool.submit(run_lead, lead_rows) for lead_rows in by_lead.values()]
+                for fut in as_completed(futures):
+                    out, errs = fut.result()
+                    results.extend(out)
+                    errors += errs
+
+        wall = time.monotonic() - started
+        with self._lock:
+            latencies = list(self._dial_latencies)
+
+        rows_total = sum(len(r) for r in by_lead.values())
+        self.last_tick = {
+            "rows": rows_total,
+            "leads": len(by_lead),
+            "dials": len(latencies),
+            "errors": errors,
+            "wall_sec": round(wall, 2),
+            "rows_per_sec": round(rows_total / wall, 2) if wall > 0 else 0.0,
+            "dial_p50_sec": round(_percentile(latencies, 0.50), 2),
+            "dial_p95_sec": round(_percentile(latencies, 0.95), 2),
+            "dial_max_sec": round(max(latencies), 2) if latencies else 0.0,
+        }
+        logger.info(f"📊 Dial tick: {self.last_tick}")
+        return results
+
+    def state(self) -> dict:
+        return {
+            "workers": self.workers,
+            "per_agent_cap": self.per_agent_cap,
+            "per_caller_cap": self.per_caller_cap,
+            "in_flight": self.in_flight,
+            "last_tick": self.last_tick,
+        }
+
+
+dial_engine = DialEngine()
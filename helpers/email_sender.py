@@ -1,7 +1,6 @@
-import requests
-from config import BITRIX_WEBHOOK
 from datetime import datetime, timedelta, timezone
-from config import BITRIX_WEBHOOK, supabase
+from config import supabase
+from helpers.bitrix_client import bitrix_post
 def send_manual_retry_email(lead_id, lead_name, lead_phone, lead_email):
     """
     Sends an email to lead via Bitrix REST API without changing the lead stage.
@@ -88,11 +87,9 @@ def send_manual_retry_email(lead_id, lead_name, lead_phone, lead_email):
 
 
 
-    url = f"{BITRIX_WEBHOOK}crm.activity.add.json"
-
     print("📧 Sending retry email:", payload)
 
-    res = requests.post(url, json=payload)
+    res = bitrix_post("crm.activity.add", json=payload)
     print("📩 Bitrix email response:", res.text)
 
     return res.json()
@@ -142,7 +139,8 @@ def send_retry_email_once_per_day(
         lead_email=lead_email
     )
 
-    # ✅ Log AFTER sending
+    # ✅ Log AFTER sending — synchronously: can_send_email_today reads this
+    # table, so it must not sit in the batched audit writer
     supabase.table("lead_email_log").insert({
         "lead_id": lead_id,
         "email_type": EMAIL_TYPE,
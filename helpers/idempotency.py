@@ -0,0 +1,104 @@
+# helpers/idempotency.py
+"""
+Idempotency for Bolna post-call webhooks, keyed on execution id + status.
+
+An in-memory seen-set answers repeats in O(1) with no I/O; the Supabase
+table `bolna_webhook_events` (unique on execution_id, status) makes the
+decision durable across restarts and workers.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from config import supabase
+
+IDEMPOTENCY_MEMORY_SIZE = int(os.getenv("IDEMPOTENCY_MEMORY_SIZE", "20000"))
+IDEMPOTENCY_WARM_HOURS = int(os.getenv("IDEMPOTENCY_WARM_HOURS", "24"))
+EVENTS_TABLE = "bolna_webhook_events"
+
+
+def _is_unique_violation(e: Exception) -> bool:
+    code = getattr(e, "code", None)
+    return code == "23505" or "duplicate key" in str(e).lower()
+
+
+class EventDeduper:
+    def __init__(self, maxsize: int = IDEMPOTENCY_MEMORY_SIZE):
+        self.maxsize = maxsize
+        self._seen: OrderedDict[tuple[str, str], None] = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def _remember(self, key) -> bool:
+        """Returns False if the key was already seen."""
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return False
+            self._seen[key] = None
+            while len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+            return True
+
+    def claim(self, execution_id, status) -> bool:
+        """
+        True if this (execution_id, status) is new and the caller should
+        process it; False for a duplicate.
+        """
+        key = (str(execution_id), str(status))
+        if not self._remember(key):
+            self.duplicates += 1
+            return False
+
+        try:
+            supabase.table(EVENTS_TABLE).insert({
+                "execution_id": key[0],
+                "status": key[1],
+                "received_at": datetime.now(timezone.utc).isoformat(),
+            }).execute()
+        except Exception as e:
+            if _is_unique_violation(e):
+                self.duplicates += 1
+                return False
+            # Fail open: losing dedupe is better than dropping a call result
+            print("⚠️ Idempotency insert error (processing anyway):", e)
+
+        return True
+
+    def release(self, execution_id, status):
+        """Forget a claim whose processing failed, so a redelivery can retry it."""
+        key = (str(execution_id), str(status))
+        with self._lock:
+            self._seen.pop(key, None)
+        try:
+            (supabase.table(EVENTS_TABLE)
+             .delete()
+             .eq("execution_id", key[0])
+             .eq("status", key[1])
+             .execute())
+        except Exception as e:
+            print("⚠️ Idempotency release error:", e)
+
+    def warm(self, hours: int = IDEMPOTENCY_WARM_HOURS):
+        since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+        try:
+            res = (supabase.table(EVENTS_TABLE)
+                   .select("execution_id,status")
+                   .gte("received_at", since)
+                   .order("received_at", desc=True)
+                   .limit(self.maxsize)
+                   .execute())
+        except Exception as e:
+            print("⚠️ Idempotency warm-up error:", e)
+            return
+
+        for row in reversed(res.data or []):
+            self._remember((str(row["execution_id"]), str(row["status"])))
+        print(f"🧾 Idempotency set warmed: {len(res.data or [])} recent events")
+
+    def state(self) -> dict:
+        return {"remembered": len(self._seen), "duplicates": self.duplicates}
+
+
+post_call_dedupe = EventDeduper()
@@ -0,0 +1,240 @@
+# helpers/ingest_queue.py
+"""
+Durable local ingest queue (SQLite outbox in WAL mode).
+
+With WEBHOOK_INGEST_MODE=queue, webhook endpoints write the raw payload
+here and answer 202 immediately; worker coroutines drain the outbox with
+bounded concurrency and run the same process_* handlers the inline mode
+uses. A claimed row is leased to one worker process (claimed_by,
+lease_until); rows whose lease expired — their worker crashed — are
+claimable again, so several processes can share the outbox safely.
+Every claim gets its own token in claimed_by, and complete()/fail() only
+touch a row that still carries it: a worker whose job outlived the lease
+cannot delete or reset the claim that replaced it.
+"""
+import asyncio
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from fastapi.responses import JSONResponse
+
+from helpers.blocking import run_blocking
+from helpers.logger import logger
+
+WEBHOOK_INGEST_MODE = os.getenv("WEBHOOK_INGEST_MODE", "inline")  # inline | queue
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest_queue.db")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+INGEST_RETRY_BASE_SECONDS = 5
+INGEST_IDLE_POLL_SECONDS = 1.0
+# Must comfortably exceed the slowest handler run
+INGEST_LEASE_SECONDS = int(os.getenv("INGEST_LEASE_SECONDS", "300"))
+INGEST_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class IngestQueue:
+    def __init__(self, path: str = INGEST_QUEUE_PATH):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._claims = itertools.count(1)
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT,
+                    claimed_by TEXT,
+                    lease_until REAL
+                )
+            """)
+            # Outbox files created before leases existed
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            for column, kind in (("claimed_by", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, available_at, id)")
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, kind: str, payload) -> int:
+        now = time.time()
+        with self._lock:
+            cur = self._db().execute(
+                "INSERT INTO outbox (kind, payload, available_at, created_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), now, now),
+            )
+            return cur.lastrowid
+
+    def claim(self) -> tuple[int, str, object, int, str] | None:
+        """
+        Atomically lease the oldest available row to this process; safe
+        across processes. Rows whose lease expired are taken over.
+        Returns (id, kind, payload, attempts, claim token).
+        """
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = db.execute(
+                    "SELECT id, kind, payload, attempts FROM outbox "
+                    "WHERE (status = 'pending' AND available_at <= ?) "
+                    "   OR (status = 'processing' AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                token = f"{INGEST_WORKER_ID}:{next(self._claims)}"
+                if row:
+                    db.execute(
+                        "UPDATE outbox SET status = 'processing', claimed_by = ?, lease_until = ? WHERE id = ?",
+                        (token, now + INGEST_LEASE_SECONDS, row[0]),
+                    )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+        if not row:
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3], token
+
+    def complete(self, job_id: int, token: str) -> bool:
+        """Delete a finished job; False if its lease was taken over meanwhile."""
+        with self._lock:
+            cur = self._db().execute("DELETE FROM outbox WHERE id = ? AND claimed_by = ?", (job_id, token))
+        if not cur.rowcount:
+            logger.warning(f"⚠️ Ingest job {job_id}: lease lost before completion, left to its new owner")
+        return bool(cur.rowcount)
+
+    def fail(self, job_id: int, attempts: int, error: str, token: str) -> bool:
+        """Schedule a retry (or dead-letter); False if the lease was taken over."""
+        attempts += 1
+        with self._lock:
+            if attempts >= INGEST_MAX_ATTEMPTS:
+                cur = self._db().execute(
+                    "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ?, "
+                    "claimed_by = NULL, lease_until = NULL WHERE id = ? AND claimed_by = ?",
+                    (attempts, error, job_id, token),
+                )
+            else:
+                retry_at = time.time() + INGEST_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+                cur = self._db().execute(
+                    "UPDATE outbox SET status = 'pending', attempts = ?, available_at = ?, last_error = ?, "
+                    "claimed_by = NULL, lease_until = NULL WHERE id = ? AND claimed_by = ?",
+                    (attempts, retry_at, error, job_id, token),
+                )
+        if not cur.rowcount:
+            logger.warning(f"⚠️ Ingest job {job_id}: lease lost before failure was recorded, left to its new owner")
+        return bool(cur.rowcount)
+
+    def recover(self) -> int:
+        """
+        Put rows orphaned by a crash back in line. Only expired leases (or
+        rows from before leases existed): another live worker's jobs stay put.
+        """
+        with self._lock:
+            cur = self._db().execute(
+                "UPDATE outbox SET status = 'pending', claimed_by = NULL, lease_until = NULL "
+                "WHERE status = 'processing' AND (lease_until IS NULL OR lease_until < ?)",
+                (time.time(),),
+            )
+            return cur.rowcount
+
+    def depth(self) -> dict:
+        with self._lock:
+            rows = self._db().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+ingest_queue = IngestQueue()
+
+_handlers: dict = {}
+_workers: list[asyncio.Task] = []
+_wake: asyncio.Event | None = None
+
+
+def register_handler(kind: str, handler):
+    """handler(payload) is a sync function; it runs on the blocking-I/O pool."""
+    _handlers[kind] = handler
+
+
+async def _worker(n: int):
+    while True:
+        job = await run_blocking(ingest_queue.claim)
+        if job is None:
+            _wake.clear()
+            try:
+                await asyncio.wait_for(_wake.wait(), timeout=INGEST_IDLE_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        job_id, kind, payload, attempts, token = job
+        handler = _handlers.get(kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"no handler registered for {kind}")
+            await run_blocking(handler, payload)
+            await run_blocking(ingest_queue.complete, job_id, token)
+        except Exception as e:
+            logger.exception(f"🔥 Ingest job {job_id} ({kind}) failed")
+            await run_blocking(ingest_queue.fail, job_id, attempts, str(e), token)
+
+
+async def start_workers(count: int = INGEST_WORKERS):
+    global _wake
+    if WEBHOOK_INGEST_MODE != "queue" or _workers:
+        return
+
+    _wake = asyncio.Event()
+    recovered = await run_blocking(ingest_queue.recover)
+    if recovered:
+        logger.info(f"♻️ Ingest queue: {recovered} in-flight jobs recovered")
+
+    for n in range(count):
+        _workers.append(asyncio.create_task(_worker(n)))
+    logger.info(f"📥 Ingest queue: {count} workers started")
+
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
+
+
+async def dispatch_webhook(kind: str, payload, handler):
+    """
+    Inline mode: process now on the blocking pool and return the result.
+    Queue mode: persist the payload and acknowledge with 202.
+    """
+    if WEBHOOK_INGEST_MODE != "queue":
+        return await run_blocking(handler, payload)
+
+    job_id = await run_blocking(ingest_queue.enqueue, kind, payload)
+    if _wake is not None:
+        _wake.set()
+    return JSONResponse(status_code=202, content={"status": "accepted", "queue_id": job_id})
+
+
+def queue_state() -> dict:
+    return {
+        "mode": WEBHOOK_INGEST_MODE,
+        "workers": len(_workers),
+        "depth": ingest_queue.depth() if WEBHOOK_INGEST_MODE == "queue" else {},
+    }
@@ -0,0 +1,80 @@
+# helpers/lead_cache.py
+"""
+Bounded LRU + TTL cache for crm.lead.get results.
+
+Read-through access lives in helpers.bitrix_client.get_lead; every
+crm.lead.update we send invalidates the lead's entry.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LEAD_CACHE_SIZE = int(os.getenv("LEAD_CACHE_SIZE", "1000"))
+LEAD_CACHE_TTL = float(os.getenv("LEAD_CACHE_TTL", "60"))  # seconds
+
+
+class LeadCache:
+    def __init__(self, maxsize: int = LEAD_CACHE_SIZE, ttl: float = LEAD_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, lead_id) -> dict | None:
+        key = str(lead_id)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, lead = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return lead
+
+    def put(self, lead_id, lead: dict):
+        key = str(lead_id)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, lead)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, lead_id):
+        with self._lock:
+            if self._data.pop(str(lead_id), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_sec": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+lead_cache = LeadCache()
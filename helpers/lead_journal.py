@@ -0,0 +1,72 @@
+# helpers/lead_journal.py
+"""
+Append-only journal for lead call history.
+
+Entries are written as lead timeline comments, so a write never has to
+download and re-send the lead's COMMENTS field. Payload size per call is
+the size of the entry, however old the lead is.
+
+LEAD_JOURNAL_MODE:
+  - "timeline" (default): timeline comment only, COMMENTS is left alone.
+  - "summary": timeline comment, and COMMENTS is overwritten with a bounded
+    copy of the latest entry (a rolling summary, never appended to).
+"""
+import os
+import re
+
+from helpers.bitrix_client import BitrixBatch
+
+LEAD_JOURNAL_MODE = os.getenv("LEAD_JOURNAL_MODE", "timeline")
+LEAD_SUMMARY_MAX_CHARS = int(os.getenv("LEAD_SUMMARY_MAX_CHARS", "2000"))
+
+
+def bounded_summary(entry_html: str, max_chars: int = LEAD_SUMMARY_MAX_CHARS) -> str:
+    if len(entry_html) <= max_chars:
+        return entry_html
+
+    # Don't cut through a tag: fall back to plain text
+    text = re.sub(r"<[^>]+>", " ", entry_html)
+    text = re.sub(r"\s+", " ", text).strip()
+    return f"<p>{text[:max_chars - 10]}…</p>"
+
+
+def append_lead_journal(
+    lead_id,
+    entry_html: str,
+    batch: BitrixBatch | None = None,
+    update_fields: dict | None = None,
+):
+    """
+    Add one journal entry to the lead.
+
+    With `batch`, the commands are queued and the caller executes it. With
+    `update_fields` (a crm.lead.update the caller is about to send), the
+    rolling summary is merged into it instead of costing another update.
+    """
+    if not lead_id or not entry_html:
+        return
+
+    own_batch = batch is None
+    if own_batch:
+        batch = BitrixBatch()
+
+    batch.add(
+        "crm.timeline.comment.add",
+        {
+            "fields": {
+                "ENTITY_ID": lead_id,
+                "ENTITY_TYPE": "lead",
+                "COMMENT": entry_html
+            }
+        }
+    )
+
+    if LEAD_JOURNAL_MODE == "summary":
+        summary = bounded_summary(entry_html)
+        if update_fields is not None:
+            update_fields["COMMENTS"] = summary
+        else:
+            batch.add("crm.lead.update", {"id": lead_id, "fields": {"COMMENTS": summary}})
+
+    if own_batch:
+        batch.execute()
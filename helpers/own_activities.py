@@ -0,0 +1,35 @@
+# helpers/own_activities.py
+"""
+Bounded memory of Bitrix activity IDs created by this service (emails,
+RM meetings), so the activity webhook can drop our own echo events
+without a DB round trip.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+OWN_ACTIVITY_MEMORY = int(os.getenv("OWN_ACTIVITY_MEMORY", "5000"))
+
+
+class OwnActivities:
+    def __init__(self, maxsize: int = OWN_ACTIVITY_MEMORY):
+        self.maxsize = maxsize
+        self._ids: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, activity_id):
+        if not activity_id:
+            return
+        with self._lock:
+            self._ids[str(activity_id)] = None
+            while len(self._ids) > self.maxsize:
+                self._ids.popitem(last=False)
+
+    def __contains__(self, activity_id) -> bool:
+        return str(activity_id) in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+
+own_activities = OwnActivities()
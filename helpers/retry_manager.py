@@ -3,73 +3,128 @@ from datetime import datetime, timedelta, timezone
 import pytz
 import os
 import requests
+import socket
 import traceback
 
-from config import supabase, BOLNA_TOKEN, BITRIX_WEBHOOK
+from config import supabase, BOLNA_TOKEN
+from helpers.bitrix_client import bitrix_post, iter_list, BitrixBatch
+from helpers.lead_journal import append_lead_journal
 from dateutil.parser import isoparse
 from helpers.logger import logger
+from helpers.dial_engine import dial_engine
+from helpers.slot_allocator import slot_allocator
+from helpers.calling_calendar import calling_calendar
 
 IST = pytz.timezone("Asia/Kolkata")
 MAX_ATTEMPTS_DEFAULT = 10
 RETRY_INTERVAL_HOURS = 3
 CALL_CUTOFF_HOUR = 6  # 6 PM IST
 
+# ----------------- Schedule change hooks -----------------
+
+# In-process listeners (the retry scheduler, the slot allocator) told about
+# every schedule change this process writes: fn(lead_id, next_call_at | None). None means
+# the lead is no longer scheduled (paused).
+# written=False marks a wake-up hint that was not stored (cooldown, future
+# busy override); written_only listeners do not see those.
+_schedule_listeners = []
+
+
+def add_schedule_listener(fn, written_only=False):
+    _schedule_listeners.append((fn, written_only))
+
+
+def notify_schedule_change(lead_id, next_call_at, written=True):
+    for fn, written_only in _schedule_listeners:
+        if written_only and not written:
+            continue
+        try:
+            fn(str(lead_id), next_call_at)
+        except Exception as e:
+            print("❌ schedule listener error:", e)
+
+
+def _notify_row(row: dict | None):
+    if not row or not row.get("lead_id"):
+        return
+    notify_schedule_change(row["lead_id"], None if row.get("paused") else row.get("next_call_at"))
+
+
+def _book_slot(lead_id, next_call_at):
+    # Only times that were actually written count against the dial budget
+    if next_call_at is None:
+        slot_allocator.release(lead_id)
+    else:
+        slot_allocator.reserve(lead_id, isoparse(next_call_at) if isinstance(next_call_at, str) else next_call_at)
+
+
+add_schedule_listener(_book_slot, written_only=True)
+
 # ----------------- Supabase helpers -----------------
 
+def upsert_retry(
+    lead_id: str,
+    mode: str,
+    status: str = None,
+    *,
+    phone: str = None,
+    lead_name: str = None,
+    lead_first_name: str | None = None,
+    bolna_call_id: str = None,
+    force_attempts: int | None = None,
+):
+    """
+    Single round trip to the upsert_outbound_call_retry RPC (sql/003).
+    mode: "ensure" | "increment" | "ensure_and_increment".
+    The RPC locks the lead's row, so concurrent webhooks cannot race.
+    """
+    # Scheduling policy lives here; the RPC picks the candidate that
+    # matches the attempt count it sees on the locked row. The first-call
+    # time is only written to a row left at 0 attempts, which the combined
+    # mode never does, so it is not computed there.
+    next_call_retry = get_next_allowed_call_time(lead_first_name, attempts=1, lead_id=lead_id)
+    if mode != "ensure_and_increment":
+        next_call_first = get_next_allowed_call_time(lead_first_name, attempts=0, lead_id=lead_id)
+    else:
+        next_call_first = next_call_retry
+
+    res = supabase.rpc("upsert_outbound_call_retry", {
+        "p_lead_id": str(lead_id),
+        "p_mode": mode,
+        "p_status": status,
+        "p_next_call_first": next_call_first.isoformat(),
+        "p_next_call_retry": next_call_retry.isoformat(),
+        "p_phone": phone,
+        "p_lead_name": lead_name,
+        "p_lead_first_name": lead_first_name,
+        "p_bolna_call_id": bolna_call_id,
+        "p_force_attempts": force_attempts,
+        "p_max_attempts": MAX_ATTEMPTS_DEFAULT,
+    }).execute()
+
+    data = res.data
+    if isinstance(data, list):
+        data = data[0] if data else None
+    _notify_row(data)
+    return data
+
+
 def insert_or_increment_retry(lead_id: str, phone: str, lead_name: str = None, lead_first_name: str | None = None,reason: str = None, force_attempts: int | None = None):
     """
-    If an entry exists (paused=False and attempts < max), increment attempts and update next_call_at.
-    Else insert new entry with next_call_at = now + RETRY_INTERVAL_HOURS (or immediate if you want).
+    Make sure the lead has a due retry entry.
+    Existing paused or future-scheduled entries are left alone; otherwise a
+    new entry is inserted (attempts = force_attempts or 0).
     """
     try:
-        # Check existing active entry
-        q = supabase.table("outbound_call_retries").select("*").eq("lead_id", lead_id).execute()
-        rows = q.data or []
-        now = datetime.now(timezone.utc)
-        if rows:
-            row = rows[0]
-            if row.get("paused"):
-                return row
-            
-            # ✅ do NOT reschedule if already scheduled in future
-            if isoparse(row["next_call_at"]) > datetime.now(timezone.utc):
-                return row
-            # attempts = (row.get("attempts") or 0) + 1
-            # max_attempts = row.get("max_attempts") or MAX_ATTEMPTS_DEFAULT
-            attempts = row.get("attempts") or 0
-            next_call = get_next_allowed_call_time( row.get("lead_first_name"),attempts)
-            updated = supabase.table("outbound_call_retries").update({
-                # "attempts": attempts,
-                "next_call_at": next_call.isoformat(),
-                "last_status": reason,
-                "updated_at": now.isoformat(),
-                "bolna_call_ids": row.get("bolna_call_ids") or []
-            }).eq("lead_id", lead_id).execute()
-            return updated.data[0] if updated.data else None
-        else:
-            # new entry
-            next_call = get_next_allowed_call_time(lead_first_name,attempts=0)
-            attempts = force_attempts if force_attempts is not None else 0
-            payload = {
-                "lead_id": lead_id,
-                "lead_name": lead_name,
-                "lead_first_name": lead_first_name,  
-                "phone": phone,
-                "attempts": attempts,
-                "max_attempts": MAX_ATTEMPTS_DEFAULT,
-                "next_call_at": get_next_allowed_call_time(
-                                lead_first_name,
-                                attempts=attempts
-                            ).isoformat(),
-                "last_status": reason,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "paused": False,
-                "bolna_call_ids": []
-            }
-            res = supabase.table("outbound_call_retries").insert(payload).execute()
-            print("insert_or_increment_retry inserted for new successful:",res)
-            return res.data[0] if res.data else None
+        return upsert_retry(
+            lead_id,
+            "ensure",
+            reason,
+            phone=phone,
+            lead_name=lead_name,
+            lead_first_name=lead_first_name,
+            force_attempts=force_attempts,
+        )
     except Exception as e:
         print("❌ insert_or_increment_retry error:", e, traceback.format_exc())
         return None
@@ -77,56 +132,29 @@ def insert_or_increment_retry(lead_id: str, phone: str, lead_name: str = None, l
 
 def is_within_retry_calling_window(now_ist: datetime) -> bool:
     """
-    Retry calls allowed only between 09:00–18:00 IST
+    Retry calls allowed only inside the calling calendar
+    (09:00–18:00 IST by default, minus blackouts and holidays).
     """
-    return 9 <= now_ist.hour < 18
+    return calling_calendar.is_open(now_ist)
 
 def next_retry_window_start(now_ist: datetime) -> datetime:
     """
-    Returns next allowed retry start time (09:00 IST)
+    Returns next allowed retry start time (09:00 IST by default);
+    now_ist itself when already inside the window.
     """
-    # If before 9 AM → today 9 AM
-    if now_ist.hour < 9:
-        return now_ist.replace(hour=9, minute=0, second=0, microsecond=0)
-
-    # If after 6 PM → tomorrow 9 AM
-    if now_ist.hour >= 18:
-        next_day = now_ist + timedelta(days=1)
-        return next_day.replace(hour=9, minute=0, second=0, microsecond=0)
+    return calling_calendar.next_open(now_ist)
 
-    # Otherwise, already inside window
-    return now_ist
 
-
-def mark_retry_attempt(lead_id: str, bolna_call_id: str = None, status: str = None):
-    """Increment attempts and optionally append bolna_call_id, update last_status and next_call_at."""
+def mark_retry_attempt(lead_id: str, bolna_call_id: str = None, status: str = None, lead_first_name: str | None = None):
+    """Increment attempts, record the attempt (and bolna_call_id) in retry_call_attempts, update last_status and next_call_at."""
     try:
-        q = supabase.table("outbound_call_retries").select("*").eq("lead_id", lead_id).execute()
-        rows = q.data or []
-        now = datetime.now(timezone.utc)
-        if not rows:
-            # fallback — create
-            return insert_or_increment_retry(lead_id, phone="unknown", lead_name=None,lead_first_name=None, reason=status)
-        row = rows[0]
-        attempts = (row.get("attempts") or 0) + 1
-        max_attempts = row.get("max_attempts") or MAX_ATTEMPTS_DEFAULT
-        bolna_ids = row.get("bolna_call_ids") or []
-        if bolna_call_id:
-            bolna_ids = bolna_ids + [bolna_call_id]
-        next_call = get_next_allowed_call_time( row.get("lead_first_name"),attempts)
-        payload = {
-            "attempts": attempts,
-            "last_status": status,
-            "bolna_call_ids": bolna_ids,
-            "updated_at": now.isoformat(),
-            "next_call_at": next_call.isoformat()
-        }
-        # If attempts exceed max, mark paused True and leave reason
-        if attempts >= max_attempts:
-            payload["paused"] = True
-            payload["last_status"] = "max_attempts_reached"
-        res = supabase.table("outbound_call_retries").update(payload).eq("lead_id", lead_id).execute()
-        return res.data[0] if res.data else None
+        return upsert_retry(
+            lead_id,
+            "increment",
+            status,
+            lead_first_name=lead_first_name,
+            bolna_call_id=bolna_call_id,
+        )
     except Exception as e:
         print("❌ mark_retry_attempt error:", e)
         return None
@@ -140,25 +168,71 @@ def cancel_retry_for_lead(lead_id: str, reason: str = "cleared"):
             "last_status": reason,
             "updated_at": now.isoformat()
         }).eq("lead_id", lead_id).execute()
+        notify_schedule_change(lead_id, None)
         return res.data
     except Exception as e:
         print("❌ cancel_retry_for_lead error:", e)
         return None
 
-# Query due entries
-def get_due_retries(limit=200):
-    now = datetime.now(timezone.utc).isoformat()
+# Leases: every worker claims a disjoint batch (sql/005). The claim returns
+# only what the due pipeline reads: lead_id, phone, lead_name,
+# lead_first_name, attempts, max_attempts, next_call_at, last_call_at,
+# busy_call_at, busy_call_consumed.
+RETRY_WORKER_ID = os.getenv("RETRY_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+RETRY_LEASE_SECONDS = int(os.getenv("RETRY_LEASE_SECONDS", "300"))
+
+
+def claim_due_retries(limit=200, lead_ids: list[str] | None = None) -> list[dict]:
+    """
+    Atomically lease up to `limit` due rows to this worker, oldest first.
+    Rows leased by another worker (unexpired) are skipped, never waited on.
+    """
     try:
-        q = (supabase.table("outbound_call_retries")
-             .select("*")
-             .lte("next_call_at", now)
-             .eq("paused", False)
-             .execute())
-        return q.data or []
+        res = supabase.rpc("claim_due_retries", {
+            "p_worker": RETRY_WORKER_ID,
+            "p_limit": limit,
+            "p_lease_seconds": RETRY_LEASE_SECONDS,
+            "p_lead_ids": [str(i) for i in lead_ids] if lead_ids is not None else None,
+        }).execute()
+        return res.data or []
     except Exception as e:
-        print("❌ get_due_retries error:", e)
+        print("❌ claim_due_retries error:", e)
         return []
 
+
+def renew_retry_claim(lead_id) -> bool:
+    """
+    Right before a dial: extend this worker's lease on the lead, or report
+    that it expired (and may now belong to another worker). A batch can
+    outlive RETRY_LEASE_SECONDS, so the lease taken at claim time is not
+    proof the row is still ours.
+    """
+    try:
+        res = supabase.rpc("renew_retry_claim", {
+            "p_worker": RETRY_WORKER_ID,
+            "p_lead_id": str(lead_id),
+            "p_lease_seconds": RETRY_LEASE_SECONDS,
+        }).execute()
+        return res.data is True
+    except Exception as e:
+        # Not dialing is safe: the row stays due and is claimed again
+        print("❌ renew_retry_claim error:", e)
+        return False
+
+
+def release_retry_claims(lead_ids: list[str]):
+    """Drop this worker's leases once its rows are handled."""
+    if not lead_ids:
+        return
+    try:
+        supabase.table("outbound_call_retries").update({
+            "claimed_by": None,
+            "lease_until": None
+        }).eq("claimed_by", RETRY_WORKER_ID).in_("lead_id", lead_ids).execute()
+    except Exception as e:
+        # The lease simply expires
+        print("❌ release_retry_claims error:", e)
+
 # ----------------- Bolna caller -----------------
 
 def can_bypass_time_restrictions(lead_first_name: str | None) -> bool:
@@ -186,6 +260,7 @@ def apply_busy_call_override(lead_id: str, busy_call_next: str):
             "next_call_at": dt.astimezone(timezone.utc).isoformat(),
             "updated_at": datetime.now(timezone.utc).isoformat()
         }).eq("lead_id", lead_id).execute()
+        notify_schedule_change(lead_id, dt.astimezone(timezone.utc).isoformat())
 
         print(f"⏰ Busy override scheduled for {dt}")
 
@@ -195,30 +270,44 @@ def apply_busy_call_override(lead_id: str, busy_call_next: str):
         return False
 
 
+def level_window_time(lead_id, lead_first_name: str | None, window_time_ist: datetime) -> datetime:
+    """
+    Spread a call that would land exactly on a window boundary (09:00,
+    12:01, ...) over the rest of the calling window, per the dial budget.
+    Without a lead_id, or for test leads, the boundary itself is returned.
+    """
+    if lead_id is None or can_bypass_time_restrictions(lead_first_name):
+        return window_time_ist.astimezone(timezone.utc)
+
+    # Stay inside the open interval (e.g. Sunday 09:00 ends at the 10:00 blackout)
+    window_end = calling_calendar.open_until(window_time_ist)
+    return slot_allocator.allocate(lead_id, window_time_ist, window_end)
+
+
 def get_next_allowed_call_time(
     lead_first_name: str | None,
     attempts:int = 1,
-    base_time_ist: datetime | None = None
+    base_time_ist: datetime | None = None,
+    lead_id: str | None = None
 ):
     """
     Returns next allowed call time in UTC,
     respecting Sunday 10–12 hard blackout.
+    With lead_id, times snapped to a window start are load-leveled.
     """
     if not base_time_ist:
         base_time_ist = datetime.now(IST)
 
     # 🔴 HARD BLOCK: Sunday 10–12 (ALL calls)
     if is_sunday_blackout_window(base_time_ist):
-        next_try = base_time_ist.replace(
-            hour=12, minute=1, second=0, microsecond=0
-        )
-        return next_try.astimezone(timezone.utc)
+        next_try = calling_calendar.resume_after(base_time_ist)
+        return level_window_time(lead_id, lead_first_name, next_try)
     
     # ✅ FIRST CALL → IMMEDIATE
     if attempts == 0:
         if is_within_retry_calling_window(base_time_ist):
             return base_time_ist.astimezone(timezone.utc)
-        return next_retry_window_start(base_time_ist).astimezone(timezone.utc)
+        return level_window_time(lead_id, lead_first_name, next_retry_window_start(base_time_ist))
 
 
     # policy = get_lead_calling_policy(lead_first_name)
@@ -236,6 +325,7 @@ def get_next_allowed_call_time(
 
     # Step 1: enforce retry calling window (9 AM – 6 PM)
     adjusted_base = next_retry_window_start(base_time_ist)
+    snapped = adjusted_base != base_time_ist
 
     # Step 2: add retry interval
     policy = get_lead_calling_policy(lead_first_name)
@@ -252,7 +342,11 @@ def get_next_allowed_call_time(
     # Step 3: if interval pushed it outside window → move to next 9 AM
     if not is_within_retry_calling_window(next_try):
         next_try = next_retry_window_start(next_try)
+        snapped = True
 
+    # Every row snapped to the same boundary would otherwise share one second
+    if snapped:
+        return level_window_time(lead_id, lead_first_name, next_try)
 
     return next_try.astimezone(timezone.utc)
 
@@ -273,10 +367,11 @@ def get_lead_calling_policy(lead_first_name: str | None):
         }
 
 
-def place_bolna_call(phone: str, lead_id: str, lead_name: str = None, user_data: dict = None,lead_first_name: str = None):
+def place_bolna_call(phone: str, lead_id: str, lead_name: str = None, user_data: dict = None,lead_first_name: str = None, guard=None):
     """
     Trigger Bolna call API and return bolna response JSON.
     Ensure BOLNA_TOKEN env var is set.
+    guard: optional check run once a dial slot is held; False skips the call.
     """
     try:
         if not BOLNA_TOKEN:
@@ -284,11 +379,12 @@ def place_bolna_call(phone: str, lead_id: str, lead_name: str = None, user_data:
             # Select agent based on lead_name
        
         agent_id = select_bolna_agent(lead_name, lead_first_name)
+        caller_id = os.getenv("CALLER_ID", "+918035316588")
             
         payload = {
             "agent_id": agent_id,
             "recipient_phone_number": phone,
-            "from_phone_number": os.getenv("CALLER_ID", "+918035316588"),
+            "from_phone_number": caller_id,
             "user_data": {"lead_id": lead_id, "lead_name": lead_name}
         }
         if user_data:
@@ -297,7 +393,10 @@ def place_bolna_call(phone: str, lead_id: str, lead_name: str = None, user_data:
             "Authorization": f"Bearer {BOLNA_TOKEN}",
             "Content-Type": "application/json"
         }
-        resp = requests.post("https://api.bolna.ai/call", json=payload, headers=headers, timeout=20)
+        with dial_engine.slot(agent_id, caller_id):
+            if guard and not guard():
+                return {"skipped": True}
+            resp = requests.post("https://api.bolna.ai/call", json=payload, headers=headers, timeout=20)
         return resp.json()
     except Exception as e:
         print("❌ place_bolna_call error:", e)
@@ -324,13 +423,9 @@ def select_bolna_agent(lead_name: str | None, lead_first_name: str | None) -> st
 
 def is_sunday_blackout_window(now_ist: datetime) -> bool:
     """
-    Returns True if current time is Sunday between 10:00 and 12:00 IST
+    Returns True inside a weekly blackout (Sunday 10:00–12:00 IST by default)
     """
-    # weekday(): Monday=0 ... Sunday=6
-    if now_ist.weekday() == 6:
-        if 10 <= now_ist.hour < 12:
-            return True
-    return False
+    return calling_calendar.in_blackout(now_ist)
 
 def ensure_utc(dt: datetime) -> datetime:
     if dt.tzinfo is None:
@@ -380,189 +475,267 @@ def process_due_retries(verify_bitrix_lead=True, limit=200):
     Returns a list of dicts describing actions.
     """
     logger.info("⏳ Checking retry queue...")
-    results = []
-    due = get_due_retries(limit=limit)
-    logger.info(f"📦 Due retries found: {len(due)}")
-    for idx, r in enumerate(due, start=1):
-        lead_id = r.get("lead_id")
-        logger.info(f"➡️ [{idx}/{len(due)}] Processing lead {lead_id}")
-        phone = r.get("phone")
-        attempts = r.get("attempts") or 0
-        max_attempts = r.get("max_attempts") or MAX_ATTEMPTS_DEFAULT
-
-
-        if lead_id:
-            get_res = requests.get(
-            f"{BITRIX_WEBHOOK}crm.lead.get.json",
-            params={"id": lead_id},
-            timeout=10
-        )
-        lead_data = get_res.json().get("result", {})
-        existing_comments = lead_data.get("COMMENTS") or ""
+    # Bounded, oldest-first slice leased to this worker; the next tick
+    # (or another worker) picks up the rest
+    due = claim_due_retries(limit=limit)
+    logger.info(f"📦 Due retries claimed: {len(due)}")
 
+    try:
+        return run_due_pipeline(due, verify_bitrix_lead=verify_bitrix_lead)
+    finally:
+        release_retry_claims([r["lead_id"] for r in due])
 
 
-        # Fetch lead created_at for cutoff logic
-        lead_created_at = None
+def _plan_due_retry(r: dict, now_utc: datetime) -> tuple[str, object]:
+    """
+    Decide what a due row needs from its own columns only — no I/O.
+    Returns (action, detail).
+    """
+    lead_first_name = r.get("lead_first_name")
+    attempts = r.get("attempts") or 0
+    max_attempts = r.get("max_attempts") or MAX_ATTEMPTS_DEFAULT
+
+    if attempts >= max_attempts:
+        return "pause_max", None
+
+    last_call_at = r.get("last_call_at")
+    if last_call_at:
+        cooldown = get_cooldown_delta(lead_first_name)
+        last_dt = ensure_utc(isoparse(last_call_at))
+        if now_utc - last_dt < cooldown:
+            return "cooldown", last_dt + cooldown
+
+    # 🔥🔥🔥 BUSY OVERRIDE — ABSOLUTE PRIORITY 🔥🔥🔥
+    busy_call_at = r.get("busy_call_at")
+    if busy_call_at and not r.get("busy_call_consumed", False):
         try:
-            # br = requests.get(f"{BITRIX_WEBHOOK}crm.lead.get.json", params={"id": lead_id}, timeout=10)
-            lead_data = get_res.json().get("result", {})
-            lead_created_at = lead_data.get("DATE_CREATE") or lead_data.get("created_at")
-        except Exception as e:
-            print("⚠️ could not fetch lead created_at:", e)
+            busy_dt = isoparse(busy_call_at)
+        except Exception:
+            # ❌ Bad AI extraction → consume override and fall back to normal retries
+            return "busy_invalid", None
 
-        if attempts >= max_attempts:
-            # mark paused
-            cancel_retry_for_lead(lead_id, reason="max_attempts_reached")
-            results.append({"lead_id": lead_id, "action": "paused_max_attempts"})
-            continue
+        # Not time yet → wait
+        if busy_dt > now_utc:
+            return "wait", busy_dt
 
-        lead_first_name =  r.get("lead_first_name")
+        # ⏰ Time reached → place call IMMEDIATELY (bypass all rules)
+        return "busy_call", None
 
-        last_call_at = r.get("last_call_at")
+    if isoparse(r["next_call_at"]) > now_utc:
+        # Not time yet → do nothing
+        return "wait", None
 
-        if last_call_at:
-            cooldown = get_cooldown_delta(lead_first_name)
-            last_dt = ensure_utc(isoparse(last_call_at))
-            now_utc = datetime.now(timezone.utc)
+    now_ist = now_utc.astimezone(IST)
 
-            delta = now_utc - last_dt
+    if is_sunday_blackout_window(now_ist):
+        return "reschedule", None
 
-            if delta < cooldown:
-                logger.warning(
-                    f"⛔ Cooldown active for lead {lead_id}. "
-                    f"Last call {delta} ago"
-                )
-                continue
+    if (
+        not can_bypass_time_restrictions(lead_first_name)
+        and not is_within_retry_calling_window(now_ist)
+    ):
+        return "reschedule", None
 
+    return "call", None
 
 
-        now_utc = datetime.now(timezone.utc)
+def _update_leads(lead_ids: list, fields: dict):
+    """One UPDATE for a set of leads."""
+    if not lead_ids:
+        return
+    fields = {**fields, "updated_at": datetime.now(timezone.utc).isoformat()}
+    supabase.table("outbound_call_retries").update(fields).in_("lead_id", lead_ids).execute()
 
-        # 🔥🔥🔥 BUSY OVERRIDE — ABSOLUTE PRIORITY 🔥🔥🔥
-        busy_call_at = r.get("busy_call_at")
-        busy_consumed = r.get("busy_call_consumed", False)
 
-        if busy_call_at and not busy_consumed:
-            try:
-                busy_dt = isoparse(busy_call_at)
-            except Exception:
-                # ❌ Bad AI extraction → consume override and fall back to normal retries
-                supabase.table("outbound_call_retries").update({
-                    "busy_call_consumed": True,
-                    "busy_call_at": None,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }).eq("lead_id", lead_id).execute()
+def _reschedule_many(next_calls: dict, reason: str = "outside_window"):
+    """lead_id -> next_call_at (UTC datetime), applied in one statement (sql/006)."""
+    if not next_calls:
+        return
 
-                continue
+    planned = {str(lead_id): t.astimezone(timezone.utc).isoformat() for lead_id, t in next_calls.items()}
 
-            # Not time yet → wait
-            if busy_dt > now_utc:
-                continue
+    res = supabase.rpc("bulk_reschedule_retries", {
+        "p_lead_ids": list(planned),
+        "p_next_call_at": list(planned.values()),
+    }).execute()
 
-            # ⏰ Time reached → place call IMMEDIATELY (bypass all rules)
-            logger.info(f"📞 Calling lead {lead_id}")
-            bolna_response = place_bolna_call(
-                phone=phone,
-                lead_id=lead_id,
-                lead_name=r.get("lead_name"),
-                lead_first_name=lead_first_name
-            )
-            logger.info(f"📞 Bolna response received for {lead_id}")
-
-            bolna_id = bolna_response.get("id") or bolna_response.get("call_id")
-
-            # ✅ Mark override as consumed (IMPORTANT)
-            supabase.table("outbound_call_retries").update({
-                "busy_call_consumed": True,
-                "busy_call_at": None, 
-                "last_call_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }).eq("lead_id", lead_id).execute()
-
-            # ❌ Do NOT increment attempts here
-            results.append({
-                "lead_id": lead_id,
-                "action": "busy_override_call_placed",
-                "bolna_id": bolna_id
-            })
-
-            requests.post(
-                f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                json={
-                    "fields": {
-                        "ENTITY_ID": lead_id,
-                        "ENTITY_TYPE": "lead",
-                        "COMMENT": "⏰ Busy override call placed at user-requested time"
-                    }
-                }
-            )
+    # Only rows the update actually moved (paused ones are skipped)
+    moved = [str(row["lead_id"]) for row in res.data or []]
+    for lead_id in moved:
+        notify_schedule_change(lead_id, planned[lead_id])
 
+    times = [planned[lead_id] for lead_id in moved]
+    logger.info(
+        f"⛔ Rescheduled {len(moved)}/{len(planned)} leads ({reason})"
+        + (f" to {min(times)} … {max(times)}" if times else "")
+    )
 
-            continue
 
-        if isoparse(r["next_call_at"]) > now_utc:
-            # Not time yet → do nothing
-            continue
+def _missing_leads(lead_ids: list) -> set:
+    """
+    Leads Bitrix reports as not found (deleted). One batch call per 50 leads.
+    Lead status is not checked: converted leads keep getting calls.
+    """
+    batch = BitrixBatch()
+    keys = {lead_id: batch.add("crm.lead.get", {"id": lead_id}) for lead_id in lead_ids}
+    batch.execute()
 
-        now_utc = datetime.now(timezone.utc)
-        now_ist = now_utc.astimezone(IST)
+    missing = set()
+    for lead_id, key in keys.items():
+        # Only Bitrix's own "Not found" counts; a transport failure is
+        # not proof the lead is gone, so it is dialed anyway
+        if not batch.result(key) and "not found" in str(batch.error(key) or "").lower():
+            missing.add(lead_id)
+    return missing
 
-        if is_sunday_blackout_window(now_ist):
-            next_try = get_next_allowed_call_time(lead_first_name)
-            supabase.table("outbound_call_retries").update({
-                "next_call_at": next_try.isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }).eq("lead_id", lead_id).execute()
-            continue
 
+def run_due_pipeline(rows: list[dict], verify_bitrix_lead=True) -> list:
+    """
+    Staged handling of claimed due rows:
+      1. plan every row from its own columns (no I/O),
+      2. apply pauses and reschedules as set-based updates,
+      3. verify only the leads about to be dialed (one Bitrix batch),
+      4. dial concurrently through the dial engine.
+    """
+    now_utc = datetime.now(timezone.utc)
+    results = []
+
+    plans: dict[str, list] = {}
+    for r in rows:
+        action, detail = _plan_due_retry(r, now_utc)
+        plans.setdefault(action, []).append((r, detail))
+
+    # -- max attempts → pause
+    paused = [r["lead_id"] for r, _ in plans.get("pause_max", [])]
+    if paused:
+        _update_leads(paused, {"paused": True, "last_status": "max_attempts_reached"})
+        for lead_id in paused:
+            notify_schedule_change(lead_id, None)
+            results.append({"lead_id": lead_id, "action": "paused_max_attempts"})
 
-        if (
-            not can_bypass_time_restrictions(lead_first_name)
-            and not is_within_retry_calling_window(now_ist)
-        ):
-            next_try = next_retry_window_start(now_ist)
+    # -- cooldown / future busy override → just tell the scheduler when
+    for r, until in plans.get("cooldown", []) + plans.get("wait", []):
+        if until:
+            notify_schedule_change(r["lead_id"], until.isoformat(), written=False)
 
-            supabase.table("outbound_call_retries").update({
-                "next_call_at": next_try.astimezone(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }).eq("lead_id", lead_id).execute()
+    # -- unparseable busy override → consume it
+    _update_leads(
+        [r["lead_id"] for r, _ in plans.get("busy_invalid", [])],
+        {"busy_call_consumed": True, "busy_call_at": None},
+    )
 
-            logger.info(f"⛔ Skipped call after cutoff. Rescheduled at {next_try}")
-            continue
+    # -- blackout / outside calling window → one bulk reschedule to the
+    #    next open instant (12:01 after the blackout, else the next window
+    #    start), spread over that window
+    now_ist = now_utc.astimezone(IST)
+    reopen = calling_calendar.resume_after(now_ist)
+    _reschedule_many({
+        r["lead_id"]: level_window_time(r["lead_id"], r.get("lead_first_name"), reopen)
+        for r, _ in plans.get("reschedule", [])
+    }, reason="blackout" if is_sunday_blackout_window(now_ist) else "outside_window")
+
+    dials = [(r, "busy_call") for r, _ in plans.get("busy_call", [])] + \
+            [(r, "call") for r, _ in plans.get("call", [])]
+
+    # -- Bitrix only for the leads we are about to dial
+    if verify_bitrix_lead and dials:
+        missing = _missing_leads([r["lead_id"] for r, _ in dials])
+        if missing:
+            _update_leads(list(missing), {"paused": True, "last_status": "lead_not_found"})
+            for lead_id in missing:
+                notify_schedule_change(lead_id, None)
+                results.append({"lead_id": lead_id, "action": "lead_not_found"})
+        dials = [(r, kind) for r, kind in dials if r["lead_id"] not in missing]
+
+    logger.info(
+        "🧮 Due pipeline: "
+        + ", ".join(f"{action}={len(items)}" for action, items in plans.items())
+        + f", dialing={len(dials)}"
+    )
+
+    # Leads are dialed concurrently; caps are enforced in place_bolna_call
+    results.extend(dial_engine.run(dials, _dial_due_retry, key=lambda d: d[0].get("lead_id")))
+    return results
 
-        if can_bypass_time_restrictions(lead_first_name):
-            logger.info(f"⚡ Time window bypass for lead {lead_id}")
 
+def _dial_due_retry(item: tuple[dict, str]):
+    """Place one planned call ("busy_call" or "call") and record it."""
+    r, kind = item
+    lead_id = r.get("lead_id")
+    phone = r.get("phone")
+    lead_first_name = r.get("lead_first_name")
 
+    # Checked once the dial slot is held, i.e. right before the POST
+    def still_ours():
+        return renew_retry_claim(lead_id)
 
+    if kind == "busy_call":
+        logger.info(f"📞 Calling lead {lead_id}")
+        bolna_response = place_bolna_call(
+            phone=phone,
+            lead_id=lead_id,
+            lead_name=r.get("lead_name"),
+            lead_first_name=lead_first_name,
+            guard=still_ours
+        )
+        if bolna_response.get("skipped"):
+            logger.warning(f"⏭️ Lease on lead {lead_id} expired before the dial, skipped")
+            return {"lead_id": lead_id, "action": "lease_lost"}
+        logger.info(f"📞 Bolna response received for {lead_id}")
 
-        # Place call
-        bolna_response = place_bolna_call(phone=phone, lead_id=lead_id, lead_name=r.get("lead_name"),lead_first_name=lead_first_name)
-        bolna_id = bolna_response.get("id") or bolna_response.get("call_id") or None
+        bolna_id = bolna_response.get("id") or bolna_response.get("call_id")
 
+        # ✅ Mark override as consumed (IMPORTANT)
         supabase.table("outbound_call_retries").update({
+            "busy_call_consumed": True,
+            "busy_call_at": None, 
             "last_call_at": datetime.now(timezone.utc).isoformat(),
             "updated_at": datetime.now(timezone.utc).isoformat()
         }).eq("lead_id", lead_id).execute()
 
-
-        requests.post(
-            f"{BITRIX_WEBHOOK}crm.lead.update.json",
+        # ❌ Do NOT increment attempts here
+        bitrix_post(
+            "crm.timeline.comment.add",
             json={
-                "id": lead_id,
                 "fields": {
-                    "COMMENTS": existing_comments + 
-                        f"<p><b>Retry Attempt:</b> User did not pick up. Email sent.</p>"
+                    "ENTITY_ID": lead_id,
+                    "ENTITY_TYPE": "lead",
+                    "COMMENT": "⏰ Busy override call placed at user-requested time"
                 }
             }
         )
 
-        # Mark attempt and update bolna id
-        mark_retry_attempt(lead_id=lead_id, bolna_call_id=bolna_id, status="scheduled")
+        return {
+            "lead_id": lead_id,
+            "action": "busy_override_call_placed",
+            "bolna_id": bolna_id
+        }
 
-        results.append({"lead_id": lead_id, "phone": phone, "bolna_id": bolna_id, "action": "call_scheduled"})
-    return results
+    if can_bypass_time_restrictions(lead_first_name):
+        logger.info(f"⚡ Time window bypass for lead {lead_id}")
+
+    # Place call
+    bolna_response = place_bolna_call(phone=phone, lead_id=lead_id, lead_name=r.get("lead_name"),lead_first_name=lead_first_name, guard=still_ours)
+    if bolna_response.get("skipped"):
+        logger.warning(f"⏭️ Lease on lead {lead_id} expired before the dial, skipped")
+        return {"lead_id": lead_id, "action": "lease_lost"}
+    bolna_id = bolna_response.get("id") or bolna_response.get("call_id") or None
+
+    supabase.table("outbound_call_retries").update({
+        "last_call_at": datetime.now(timezone.utc).isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }).eq("lead_id", lead_id).execute()
+
+
+    append_lead_journal(
+        lead_id,
+        "<p><b>Retry Attempt:</b> User did not pick up. Email sent.</p>"
+    )
+
+    # Mark attempt and update bolna id
+    mark_retry_attempt(lead_id=lead_id, bolna_call_id=bolna_id, status="scheduled", lead_first_name=lead_first_name)
+
+    return {"lead_id": lead_id, "phone": phone, "bolna_id": bolna_id, "action": "call_scheduled"}
 
 # ----------------- Functions for call now stage  -----------------
 
@@ -571,15 +744,13 @@ def bitrix_bool(val):
 
 
 def fetch_call_now_leads(limit=50):
-    resp = requests.get(
-        f"{BITRIX_WEBHOOK}crm.lead.list.json",
-        params={
-            "filter[UF_CRM_1766405062574]": "1",
-            "select[]": ["ID", "TITLE", "NAME", "PHONE"],
-            "start": 0
-        },timeout=10
+    """Lazily yield up to `limit` leads flagged Call Now, across all pages."""
+    return iter_list(
+        "crm.lead.list",
+        filter={"UF_CRM_1766405062574": "1"},
+        select=["ID", "TITLE", "NAME", "PHONE"],
+        limit=limit,
     )
-    return resp.json().get("result", [])[:limit]
 
 def process_call_now_leads(limit=50):
     leads = fetch_call_now_leads(limit)
@@ -596,8 +767,8 @@ def process_call_now_leads(limit=50):
         
 
         # 1️⃣ Lock lead
-        lock = requests.post(
-            f"{BITRIX_WEBHOOK}crm.lead.update.json",
+        lock = bitrix_post(
+            "crm.lead.update",
             json={
                 "id": lead_id,
                 "fields": {
@@ -619,8 +790,8 @@ def process_call_now_leads(limit=50):
         )
 
         # 5️⃣ Traceability
-        requests.post(
-            f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+        bitrix_post(
+            "crm.timeline.comment.add",
             json={
                 "fields": {
                     "ENTITY_TYPE": "lead",
@@ -637,43 +808,30 @@ def process_call_now_leads(limit=50):
 def fetch_call_now_deals(limit=50):
     """
     Fetch deals which are in Call Now stage and marked for processing.
+    Scans at most `limit` deals lazily, oldest (lowest ID) first, and yields
+    those with a phone, one per phone.
     """
-
-    resp = requests.get(
-        f"{BITRIX_WEBHOOK}crm.deal.list.json",
-        params={
-            "filter[UF_DEAL_CALL_NOW_PROCESSED]": "1",         # boolean true
-            "select[]": [
-                "ID",
-                "TITLE",
-                "STAGE_ID",
-                "LEAD_ID",
-                "UF_DEAL_CALL_NOW_PROCESSED"
-            ],
-            "order[DATE_MODIFY]": "ASC",
-            "start": 0
-        },
-        timeout=10
+    deals = iter_list(
+        "crm.deal.list",
+        filter={"UF_DEAL_CALL_NOW_PROCESSED": "1"},         # boolean true
+        select=[
+            "ID",
+            "TITLE",
+            "STAGE_ID",
+            "LEAD_ID",
+            "UF_DEAL_CALL_NOW_PROCESSED"
+        ],
+        limit=limit,
     )
 
-    if not resp.ok:
-        return []
-    
-    leads = resp.json().get("result", [])
-
     seen_phones = set()
-    unique = []
 
-    for l in leads:
-        phone = (l.get("PHONE") or [{}])[0].get("VALUE")
+    for deal in deals:
+        phone = (deal.get("PHONE") or [{}])[0].get("VALUE")
         if not phone or phone in seen_phones:
             continue
         seen_phones.add(phone)
-        unique.append(l)
-
-    return unique[:limit]
-
-    # return resp.json().get("result", [])[:limit]
+        yield deal
 
 def process_call_now_deals(limit=50):
     deals = fetch_call_now_deals(limit)
@@ -684,15 +842,14 @@ def process_call_now_deals(limit=50):
         lead_id = deal.get("LEAD_ID")
 
         # 1️⃣ Lock the deal immediately
-        lock = requests.post(
-            f"{BITRIX_WEBHOOK}crm.deal.update.json",
+        lock = bitrix_post(
+            "crm.deal.update",
             json={
                 "id": deal_id,
                 "fields": {
                     "UF_CRM_69494B5DD9293": "0"
                 }
-            },
-            timeout=10
+            }
         )
 
         if not lock.ok:
@@ -700,8 +857,8 @@ def process_call_now_deals(limit=50):
 
         # 2️⃣ No lead → comment + stop
         if not lead_id:
-            requests.post(
-                f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+            bitrix_post(
+                "crm.timeline.comment.add",
                 json={
                     "fields": {
                         "ENTITY_TYPE": "deal",
@@ -713,20 +870,19 @@ def process_call_now_deals(limit=50):
             continue
 
         # 3️⃣ Mark lead as Call Now
-        lead_update = requests.post(
-            f"{BITRIX_WEBHOOK}crm.lead.update.json",
+        lead_update = bitrix_post(
+            "crm.lead.update",
             json={
                 "id": lead_id,
                 "fields": {
                     "UF_CRM_1766405062574": "1"
                 }
-            },
-            timeout=10
+            }
         )
 
         if not lead_update.ok:
-            requests.post(
-                f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+            bitrix_post(
+                "crm.timeline.comment.add",
                 json={
                     "fields": {
                         "ENTITY_TYPE": "deal",
@@ -738,8 +894,8 @@ def process_call_now_deals(limit=50):
             continue
 
         # 5️⃣ Traceability
-        requests.post(
-            f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+        bitrix_post(
+            "crm.timeline.comment.add",
             json={
                 "fields": {
                     "ENTITY_TYPE": "deal",
@@ -0,0 +1,263 @@
+# helpers/retry_scheduler.py
+"""
+In-process scheduler for the retry worker (process_retries.py).
+
+A min-heap of (due_at, lead_id) is loaded from outbound_call_retries and
+the worker sleeps until exactly the next due time instead of scanning the
+table every minute.
+
+It is kept in sync by:
+  - schedule change hooks from helpers/retry_manager (writes made by this
+    process: upserts, cancels, busy overrides, reschedules),
+  - an incremental sync on updated_at (writes made by the web app) every
+    SCHEDULER_SYNC_SECONDS, the old poll interval; it reads only changed
+    rows through the sql/009 index, so an idle queue costs one empty
+    range scan,
+  - an hourly full resync as a safety net.
+
+Trade-off: a row the web app makes due right away (a first call inside the
+window) is seen up to SCHEDULER_SYNC_SECONDS late, as with the old loop.
+"""
+import heapq
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from dateutil.parser import isoparse
+
+from config import supabase
+from helpers.logger import logger
+from helpers.retry_manager import (
+    add_schedule_listener,
+    claim_due_retries,
+    release_retry_claims,
+    run_due_pipeline,
+)
+
+SCHEDULER_SYNC_SECONDS = float(os.getenv("SCHEDULER_SYNC_SECONDS", "60"))
+SCHEDULER_FULL_RESYNC_SECONDS = float(os.getenv("SCHEDULER_FULL_RESYNC_SECONDS", "3600"))
+SCHEDULER_RECHECK_SECONDS = float(os.getenv("SCHEDULER_RECHECK_SECONDS", "60"))
+SCHEDULER_BATCH_LIMIT = int(os.getenv("SCHEDULER_BATCH_LIMIT", "200"))
+SCHEDULER_PAGE_SIZE = 1000
+
+_SYNC_COLUMNS = "lead_id,next_call_at,busy_call_at,busy_call_consumed,paused,updated_at"
+
+
+def _ts(value) -> float | None:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _row_due_at(row: dict) -> float | None:
+    """Earliest time the row needs attention, or None if it is not scheduled."""
+    if row.get("paused"):
+        return None
+    due = _ts(row.get("next_call_at"))
+    if row.get("busy_call_at") and not row.get("busy_call_consumed"):
+        try:
+            busy = _ts(row["busy_call_at"])
+            due = busy if due is None else min(due, busy)
+        except (ValueError, OverflowError):
+            # Unparseable override: let the due pipeline consume it now
+            due = time.time()
+    return due
+
+
+class RetryScheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, str]] = []
+        self._due: dict[str, float] = {}          # lead_id -> current due time
+        self._touched: set[str] = set()           # rescheduled during a dispatch
+        self._cond = threading.Condition()
+
+        self._watermark: str | None = None
+        self._next_sync = 0.0
+        self._next_full = 0.0
+
+        self.dispatched = 0
+        self.wakeups = 0
+
+    # ---------------- heap maintenance ----------------
+
+    def schedule(self, lead_id, due_at):
+        """Set (or clear, with None) a lead's due time. Safe from any thread."""
+        key = str(lead_id)
+        due = _ts(due_at)
+        with self._cond:
+            self._touched.add(key)
+            if due is None:
+                self._due.pop(key, None)
+            else:
+                self._due[key] = due
+                # Stale entries stay in the heap and are skipped on pop
+                heapq.heappush(self._heap, (due, key))
+            self._cond.notify()
+
+    def _apply_rows(self, rows: list[dict]):
+        for row in rows:
+            self.schedule(row["lead_id"], _row_due_at(row))
+
+    def _peek(self) -> float | None:
+        while self._heap:
+            due, key = self._heap[0]
+            if self._due.get(key) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, now: float, limit: int) -> list[str]:
+        leads = []
+        while len(leads) < limit:
+            due = self._peek()
+            if due is None or due > now:
+                break
+            _, key = heapq.heappop(self._heap)
+            self._due.pop(key, None)
+            leads.append(key)
+        return leads
+
+    # ---------------- Supabase sync ----------------
+
+    def _fetch_since(self, since: str | None) -> list[dict]:
+        rows, offset = [], 0
+        while True:
+            q = supabase.table("outbound_call_retries").select(_SYNC_COLUMNS)
+            if since:
+                q = q.gte("updated_at", since)
+            else:
+                q = q.eq("paused", False)
+            page = (q.order("updated_at")
+                     .order("lead_id")
+                     .range(offset, offset + SCHEDULER_PAGE_SIZE - 1)
+                     .execute()).data or []
+            rows.extend(page)
+            if len(page) < SCHEDULER_PAGE_SIZE:
+                return rows
+            offset += SCHEDULER_PAGE_SIZE
+
+    def _advance_watermark(self, rows: list[dict]):
+        stamps = [r["updated_at"] for r in rows if r.get("updated_at")]
+        if stamps:
+            latest = max(stamps, key=_ts)
+            if self._watermark is None or _ts(latest) > _ts(self._watermark):
+                self._watermark = latest
+
+    def full_resync(self):
+        rows = self._fetch_since(None)
+        with self._cond:
+            self._heap, self._due = [], {}
+        self._apply_rows(rows)
+        self._advance_watermark(rows)
+        self._next_full = time.monotonic() + SCHEDULER_FULL_RESYNC_SECONDS
+        logger.info(f"🗓️ Retry scheduler: full resync, {len(self._due)} leads scheduled")
+
+    def incremental_sync(self):
+        if self._watermark is None:
+            return self.full_resync()
+        rows = self._fetch_since(self._watermark)
+        self._apply_rows(rows)
+        self._advance_watermark(rows)
+
+    # ---------------- dispatch ----------------
+
+    def _dispatch(self, lead_ids: list[str]):
+        with self._cond:
+            self._touched.clear()
+
+        try:
+            # Only rows this worker manages to lease; others are being handled
+            # by another worker right now
+            rows = claim_due_retries(limit=len(lead_ids), lead_ids=lead_ids)
+            try:
+                results = run_due_pipeline(rows)
+            finally:
+                release_retry_claims([r["lead_id"] for r in rows])
+        except Exception:
+            # The leads are already off the heap: put back the ones nothing
+            # rescheduled so a failed claim or pipeline does not drop them
+            # until the next full resync
+            retry_at = time.time() + SCHEDULER_RECHECK_SECONDS
+            with self._cond:
+                lost = [k for k in lead_ids if k not in self._touched]
+            for key in lost:
+                self.schedule(key, retry_at)
+            raise
+        self.dispatched += len(rows)
+
+        # Leads nobody rescheduled go back in: at their stored time if it is
+        # still ahead, otherwise after a recheck delay (the old poll interval).
+        # Leads another worker held are rechecked the same way.
+        now = time.time()
+        claimed = {str(r["lead_id"]) for r in rows}
+        with self._cond:
+            untouched = [r for r in rows if str(r["lead_id"]) not in self._touched]
+            skipped = [k for k in lead_ids if k not in claimed and k not in self._touched]
+        for row in untouched:
+            due = _row_due_at(row)
+            if due is not None:
+                self.schedule(row["lead_id"], due if due > now else now + SCHEDULER_RECHECK_SECONDS)
+        for key in skipped:
+            self.schedule(key, now + SCHEDULER_RECHECK_SECONDS)
+
+        logger.info(f"📞 Retry scheduler dispatched {len(rows)} leads, {len(results)} actions")
+        return results
+
+    def run_once(self) -> float:
+        """Do whatever is due now; returns seconds until the next wake-up."""
+        mono = time.monotonic()
+        if mono >= self._next_full:
+            self.full_resync()
+            self._next_sync = mono + SCHEDULER_SYNC_SECONDS
+        elif mono >= self._next_sync:
+            self.incremental_sync()
+            self._next_sync = mono + SCHEDULER_SYNC_SECONDS
+
+        with self._cond:
+            due_leads = self._pop_due(time.time(), SCHEDULER_BATCH_LIMIT)
+        if due_leads:
+            self._dispatch(due_leads)
+
+        with self._cond:
+            next_due = self._peek()
+        wait = self._next_sync - time.monotonic()
+        if next_due is not None:
+            wait = min(wait, next_due - time.time())
+        return max(wait, 0.0)
+
+    def run_forever(self):
+        add_schedule_listener(self.schedule)
+        logger.info("🗓️ Retry scheduler started")
+        while True:
+            try:
+                wait = self.run_once()
+            except Exception:
+                logger.exception("🔥 Retry scheduler tick failed")
+                wait = SCHEDULER_RECHECK_SECONDS
+
+            with self._cond:
+                self.wakeups += 1
+                # schedule() notifies, so an earlier due time cuts the wait short
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+
+    def state(self) -> dict:
+        with self._cond:
+            next_due = self._peek()
+            return {
+                "scheduled": len(self._due),
+                "next_due_in_sec": round(next_due - time.time(), 1) if next_due else None,
+                "watermark": self._watermark,
+                "dispatched": self.dispatched,
+                "wakeups": self.wakeups,
+            }
+
+
+retry_scheduler = RetryScheduler()
@@ -0,0 +1,189 @@
+# helpers/slot_allocator.py
+"""
+Capacity-aware placement of rescheduled calls.
+
+Rows pushed to a window start (09:00 IST, Sunday 12:01) used to land on
+the same second. allocate() spreads them instead: each lead gets a
+deterministic offset inside SLOT_SPREAD_MINUTES (same lead, same slot, so
+recomputing is stable), and from there the first minute still under
+DIAL_BUDGET_PER_MINUTE is taken.
+
+allocate() only looks; callers reserve() the time they actually wrote, so
+candidates that were never used and no-op writes book nothing. A lead holds
+at most one placement: reserving it again moves it.
+
+Placements are seeded per lead from outbound_call_retries and reloaded
+every SLOT_COUNTS_TTL_SECONDS, so separate processes converge on the same
+picture of the load. A reload replaces the window's placements, so a lead
+is never counted both from the table and from a local reserve().
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from dateutil.parser import isoparse
+
+from config import supabase
+
+DIAL_BUDGET_PER_MINUTE = int(os.getenv("DIAL_BUDGET_PER_MINUTE", "20"))
+SLOT_SPREAD_MINUTES = int(os.getenv("SLOT_SPREAD_MINUTES", "60"))
+SLOT_COUNTS_TTL_SECONDS = int(os.getenv("SLOT_COUNTS_TTL_SECONDS", "300"))
+SLOT_SCAN_PAGE_SIZE = 1000
+
+
+def _minute(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(second=0, microsecond=0)
+
+
+def lead_hash(lead_id) -> int:
+    """Stable across processes and restarts (unlike hash())."""
+    return int(hashlib.sha1(str(lead_id).encode()).hexdigest()[:12], 16)
+
+
+def _scheduled_rows(start: datetime, end: datetime) -> list[tuple[str, datetime]]:
+    """(lead_id, next_call_at) of every active row in [start, end)."""
+    rows, offset = [], 0
+    while True:
+        page = (supabase.table("outbound_call_retries")
+                .select("lead_id,next_call_at")
+                .eq("paused", False)
+                .gte("next_call_at", start.isoformat())
+                .lt("next_call_at", end.isoformat())
+                .order("next_call_at")
+                .range(offset, offset + SLOT_SCAN_PAGE_SIZE - 1)
+                .execute()).data or []
+        rows.extend((str(r["lead_id"]), isoparse(r["next_call_at"])) for r in page if r.get("next_call_at"))
+        if len(page) < SLOT_SCAN_PAGE_SIZE:
+            return rows
+        offset += SLOT_SCAN_PAGE_SIZE
+
+
+class SlotAllocator:
+    def __init__(self, budget_per_minute: int = DIAL_BUDGET_PER_MINUTE, spread_minutes: int = SLOT_SPREAD_MINUTES):
+        self.budget = budget_per_minute
+        self.spread = spread_minutes
+        # window start (minute) -> (loaded_at, window end, per-minute counts)
+        self._windows: dict[datetime, tuple[float, datetime, Counter]] = {}
+        # lead_id -> minute it is counted in (table seed or reserve())
+        self._placed: dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def _counts(self, window_start: datetime, window_end: datetime) -> Counter:
+        """Per-minute counts for the window; the table scan runs outside the lock."""
+        with self._lock:
+            cached = self._windows.get(window_start)
+            if cached and time.monotonic() - cached[0] < SLOT_COUNTS_TTL_SECONDS:
+                return cached[2]
+
+        try:
+            rows = _scheduled_rows(window_start, window_end)
+        except Exception as e:
+            print("❌ slot count load failed:", e)
+            with self._lock:
+                if cached:
+                    return cached[2]
+                counts = Counter()
+                self._windows[window_start] = (time.monotonic(), window_end, counts)
+                return counts
+
+        with self._lock:
+            # The table is now the truth for this window: drop what was
+            # counted here before and place every row it returned
+            for lead_id in [k for k, m in self._placed.items() if window_start <= m < window_end]:
+                del self._placed[lead_id]
+            for lead_id, t in rows:
+                previous = self._placed.get(lead_id)
+                if previous is not None:
+                    self._bump(previous, -1)
+                self._placed[lead_id] = _minute(t)
+            counts = Counter(m for m in self._placed.values() if window_start <= m < window_end)
+
+            # Forget windows that are already behind us
+            now = _minute(datetime.now(timezone.utc))
+            for key in [k for k in self._windows if k < now - timedelta(hours=1)]:
+                del self._windows[key]
+            for lead_id in [k for k, m in self._placed.items() if m < now - timedelta(hours=1)]:
+                del self._placed[lead_id]
+
+            self._windows[window_start] = (time.monotonic(), window_end, counts)
+            return counts
+
+    def _bump(self, minute: datetime, delta: int):
+        for start, (_, end, counts) in self._windows.items():
+            if start <= minute < end:
+                counts[minute] = max(0, counts[minute] + delta)
+
+    def allocate(self, lead_id, window_start: datetime, window_end: datetime | None = None) -> datetime:
+        """
+        Place a lead whose call would otherwise fall exactly on window_start.
+        Returns a UTC datetime in [window_start, window_end); books nothing.
+        """
+        start = _minute(window_start)
+        end = _minute(window_end) if window_end else start + timedelta(minutes=self.spread)
+        if end <= start:
+            return window_start.astimezone(timezone.utc)
+
+        h = lead_hash(lead_id)
+        span = max(1, min(self.spread, int((end - start).total_seconds() // 60)))
+        first = start + timedelta(minutes=h % span)
+        second = (h // span) % 60
+
+        counts = self._counts(start, end)
+        with self._lock:
+            slot = first
+            while slot < end and counts[slot] >= self.budget:
+                slot += timedelta(minutes=1)
+            if slot >= end:
+                # Window is full: keep the jittered slot rather than the herd second
+                slot = first
+
+        placed = slot + timedelta(seconds=second)
+        return max(placed, window_start.astimezone(timezone.utc))
+
+    def reserve(self, lead_id, when: datetime):
+        """Record the next_call_at actually written for a lead."""
+        minute = _minute(when)
+        key = str(lead_id)
+        with self._lock:
+            previous = self._placed.get(key)
+            if previous == minute:
+                return
+            if previous is not None:
+                self._bump(previous, -1)
+            self._bump(minute, 1)
+            self._placed[key] = minute
+
+    def release(self, lead_id):
+        """Drop a lead's placement (cancelled or paused)."""
+        with self._lock:
+            previous = self._placed.pop(str(lead_id), None)
+            if previous is not None:
+                self._bump(previous, -1)
+
+    def forecast(self, hours: int = 24, bucket_minutes: int = 15) -> list[dict]:
+        """Due load per bucket for the next `hours`, from outbound_call_retries."""
+        now = datetime.now(timezone.utc)
+        start = now.replace(minute=(now.minute // bucket_minutes) * bucket_minutes, second=0, microsecond=0)
+        end = now + timedelta(hours=hours)
+
+        buckets = Counter()
+        overdue = 0
+        for _, t in _scheduled_rows(now - timedelta(days=365), end):
+            t = t.astimezone(timezone.utc)
+            if t < start:
+                overdue += 1
+                continue
+            offset = int((t - start).total_seconds() // (bucket_minutes * 60))
+            buckets[start + timedelta(minutes=offset * bucket_minutes)] += 1
+
+        capacity = self.budget * bucket_minutes
+        return [{"slot": "overdue", "due": overdue, "capacity": capacity}] + [
+            {"slot": slot.isoformat(), "due": count, "capacity": capacity}
+            for slot, count in sorted(buckets.items())
+        ]
+
+
+slot_allocator = SlotAllocator()
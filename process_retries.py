@@ -1,21 +1,31 @@
 # process_retries.py
-from helpers.retry_manager import   process_call_now_leads,process_due_retries,process_call_now_deals
+from helpers.retry_manager import   process_call_now_leads,process_call_now_deals
+from helpers.retry_scheduler import retry_scheduler
+import threading
 import time
 
+CALL_NOW_POLL_SECONDS = 60
+
+
+def poll_call_now():
+    # Call Now flags live in Bitrix, so this part still polls
+    while True:
+        try:
+            print("📞 Checking Call Now deals")
+            process_call_now_deals(limit=50)
+
+            print("📞 Checking Call Now leads")
+            process_call_now_leads(limit=50)
+        except Exception as e:
+            print("❌ Call Now polling error:", e)
+
+        time.sleep(CALL_NOW_POLL_SECONDS)
+
+
 if __name__ == "__main__":
     print("🔁 Retry worker started")
 
-    # You can run continuously (recommended)
-    while True:
-        
-        print("📞 Checking Call Now leads")
-        process_call_now_deals(limit=50)
-
-        print("📞 Checking Call Now leads")
-        process_call_now_leads(limit=50)
-        
-        print("⏳ Checking retry queue...")
-        results = process_due_retries()
-        
-        print("📌 Results:", results)
-        time.sleep(60)   # check every 1 minute
+    threading.Thread(target=poll_call_now, daemon=True, name="call-now").start()
+
+    # Retry queue: sleeps until the next lead is due instead of scanning every minute
+    retry_scheduler.run_forever()
@@ -1,9 +1,11 @@
 # bitrix_activity_webhook.py
 from fastapi import APIRouter, Request
-import requests
+from urllib.parse import parse_qs
 from datetime import datetime
-from config import supabase
-from helpers.retry_manager import cancel_retry_for_lead
+from helpers.deal_index import deal_index
+from helpers.activity_coalescer import activity_coalescer
+from helpers.own_activities import own_activities
+from helpers.ingest_queue import dispatch_webhook, register_handler
 
 router = APIRouter()
 
@@ -18,8 +20,11 @@ async def bitrix_activity_webhook(request: Request):
     """
     # Bitrix sends x-www-form-urlencoded, not JSON
     raw_body = (await request.body()).decode()
-    from urllib.parse import parse_qs
+    return await dispatch_webhook("bitrix_activity", raw_body, process_activity_event)
 
+
+def process_activity_event(raw_body: str):
+    """Synchronous activity handling; runs on the blocking-I/O thread pool."""
     print("🔹 Raw incoming body:", raw_body)
 
     parsed = parse_qs(raw_body)
@@ -53,27 +58,9 @@ async def bitrix_activity_webhook(request: Request):
     if not owner_type or not owner_id:
         return {"status": "ignored", "reason": "No owner info"}
 
-    # Detect LEAD or DEAL
-    lead_id = None
-
-    # If activity belongs to a LEAD directly
-    if owner_type == "1":
-        lead_id = owner_id
-
-    # If activity belongs to a DEAL → fetch its lead from SUPABASE mapping
-    elif owner_type == "2":
-        try:
-            mapping = supabase.table("deal_lead_mapping") \
-                              .select("lead_id") \
-                              .eq("deal_id", owner_id) \
-                              .execute()
-            if mapping.data:
-                lead_id = mapping.data[0]["lead_id"]
-        except Exception as e:
-            print("⚠️ Mapping fetch error:", e)
-
-    if not lead_id:
-        return {"status": "ignored", "reason": "Lead ID not found"}
+    # Echo of an activity we created ourselves (email, RM meeting)
+    if activity_id and activity_id in own_activities:
+        return {"status": "ignored", "reason": "Activity created by this service"}
 
     # -----------------------------
     # IGNORE BOT-GENERATED ACTIVITY
@@ -106,24 +93,41 @@ async def bitrix_activity_webhook(request: Request):
     if not is_manual_call:
         return {"status": "ignored", "reason": "Activity was not a manual call"}
 
+    # Detect LEAD or DEAL
+    lead_id = None
+
+    # If activity belongs to a LEAD directly
+    if owner_type == "1":
+        lead_id = owner_id
+
+    # If activity belongs to a DEAL → resolve its lead from the lead↔deal index
+    elif owner_type == "2":
+        lead_id = deal_index.resolve_lead_for_deal(owner_id)
+
+    if not lead_id:
+        return {"status": "ignored", "reason": "Lead ID not found"}
+
     # ------------------------------
-    # MANUAL CALL DETECTED → CANCEL RETRIES
+    # MANUAL CALL DETECTED → CANCEL RETRIES (now; repeats in a burst skipped)
     # ------------------------------
-    print(f"📞 HUMAN manual call detected for LEAD {lead_id}. Cancelling retries.")
-
-    cancel_retry_for_lead(lead_id, reason="manual_call_detected")
-
-    # Log event to Supabase
-    try:
-        supabase.table("manual_call_logs").insert({
-            "timestamp": datetime.utcnow().isoformat(),
-            "lead_id": lead_id,
-            "activity_id": activity_id,
-            "provider_id": provider_id,
-            "result_status": result_status,
-            "subject": subject
-        }).execute()
-    except Exception as e:
-        print("❌ Failed to log manual call:", e)
-
-    return {"status": "success", "action": "retry_cancelled", "lead_id": lead_id}
+    cancelled = activity_coalescer.cancel_once(lead_id)
+
+    # Log rows of the burst are written together
+    pending = activity_coalescer.submit(lead_id, {
+        "timestamp": datetime.utcnow().isoformat(),
+        "lead_id": lead_id,
+        "activity_id": activity_id,
+        "provider_id": provider_id,
+        "result_status": result_status,
+        "subject": subject
+    })
+
+    return {
+        "status": "success",
+        "action": "retry_cancelled" if cancelled else "retry_already_cancelled",
+        "lead_id": lead_id,
+        "pending_events": pending,
+    }
+
+
+register_handler("bitrix_activity", process_activity_event)
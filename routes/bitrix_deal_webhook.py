@@ -0,0 +1,42 @@
+# routes/bitrix_deal_webhook.py
+from fastapi import APIRouter, Request
+from urllib.parse import parse_qs
+import os
+
+from helpers.deal_index import deal_index
+from helpers.deal_waiter import notify_deal_created
+from helpers.blocking import run_blocking
+
+router = APIRouter()
+
+# Outbound webhook token shown in Bitrix (auth[application_token]); optional
+BITRIX_OUTBOUND_TOKEN = os.getenv("BITRIX_OUTBOUND_TOKEN")
+
+
+@router.post("/bitrix-deal-webhook")
+async def bitrix_deal_webhook(request: Request):
+    """
+    Bitrix outbound webhook for ONCRMDEALADD (and ONCRMDEALUPDATE).
+    Records the lead↔deal pair and wakes any request waiting for this deal.
+    """
+    raw_body = (await request.body()).decode()
+    parsed = parse_qs(raw_body)
+    print("📥 Bitrix deal webhook received:", parsed)
+
+    if BITRIX_OUTBOUND_TOKEN and parsed.get("auth[application_token]", [None])[0] != BITRIX_OUTBOUND_TOKEN:
+        return {"status": "ignored", "reason": "bad application token"}
+
+    event = (parsed.get("event", [""])[0] or "").upper()
+    deal_id = parsed.get("data[FIELDS][ID]", [None])[0]
+
+    if event not in ("ONCRMDEALADD", "ONCRMDEALUPDATE") or not deal_id:
+        return {"status": "ignored", "reason": "not a deal event"}
+
+    # Event carries only the deal ID; the index resolves (and records) its lead
+    lead_id = await run_blocking(deal_index.resolve_lead_for_deal, deal_id)
+    if not lead_id:
+        return {"status": "ignored", "reason": "deal has no lead", "deal_id": deal_id}
+
+    woken = notify_deal_created(lead_id, deal_id)
+
+    return {"status": "success", "deal_id": deal_id, "lead_id": lead_id, "waiters_woken": woken}
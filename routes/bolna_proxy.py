@@ -1,11 +1,13 @@
 #bolna_proxy
 from fastapi import Request,APIRouter
-import requests
 router = APIRouter()
 from urllib.parse import parse_qs
 from datetime import datetime
-from config import BITRIX_WEBHOOK, BOLNA_TOKEN, supabase
+from config import BOLNA_TOKEN
+from helpers.bitrix_client import get_lead
 from helpers.retry_manager import insert_or_increment_retry
+from helpers.ingest_queue import dispatch_webhook, register_handler
+from helpers.audit_log import audit_log
 
 
 # ---------- Bitrix Lead → Bolna trigger (unchanged) ----------
@@ -14,6 +16,11 @@ from helpers.retry_manager import insert_or_increment_retry
 async def bolna_proxy(request: Request):
     raw_body = await request.body()
     raw_text = raw_body.decode("utf-8")
+    return await dispatch_webhook("bolna_proxy", raw_text, process_bolna_proxy)
+
+
+def process_bolna_proxy(raw_text: str):
+    """Synchronous lead → retry-queue handling; runs on the blocking-I/O thread pool."""
     print("🔹 Raw incoming body:", raw_text)
 
     payload = parse_qs(raw_text)
@@ -28,16 +35,13 @@ async def bolna_proxy(request: Request):
     if not lead_id:
         return {"status": "error", "reason": "Lead ID missing"}
 
-    lead_url = f"{BITRIX_WEBHOOK}crm.lead.get.json"
-    response = requests.get(lead_url, params={"id": lead_id},timeout=10)
-    if response.status_code != 200:
+    lead_data = get_lead(lead_id)
+    if not lead_data:
         return {
             "status": "error",
             "reason": "Bitrix fetch failed",
-            "bitrix_response": response.text,
         }
 
-    lead_data = response.json().get("result", {})
     phone = None
     if lead_data.get("PHONE"):
         phone = lead_data["PHONE"][0].get("VALUE")
@@ -45,16 +49,13 @@ async def bolna_proxy(request: Request):
     lead_name = lead_data.get("TITLE")
     print(f"✅ Lead name: {lead_name}, phone: {phone}")
 
-    try:
-        supabase.table("webhook_logs").insert({
-            "timestamp": datetime.utcnow().isoformat(),
-            "lead_id": lead_data.get("ID"),
-            "phone": phone,
-            "name": lead_name,
-            "payload": lead_data
-        }).execute()
-    except Exception as e:
-        print("❌ Supabase insert error:", str(e))
+    audit_log.write("webhook_logs", {
+        "timestamp": datetime.utcnow().isoformat(),
+        "lead_id": lead_data.get("ID"),
+        "phone": phone,
+        "name": lead_name,
+        "payload": lead_data
+    })
 
 
     lead_first_name = lead_data.get("NAME")
@@ -92,4 +93,4 @@ async def bolna_proxy(request: Request):
     }
 
 
-
+register_handler("bolna_proxy", process_bolna_proxy)
@@ -1,9 +1,9 @@
 # routes/call_now_webhook.py
 from fastapi import APIRouter, Request
-import requests
 
-from config import BITRIX_WEBHOOK
+from helpers.bitrix_client import get_lead
 from helpers.retry_manager import insert_or_increment_retry
+from helpers.blocking import run_blocking
 
 router = APIRouter()
 
@@ -12,6 +12,11 @@ async def bitrix_call_now(request: Request):
     # Bitrix sends FORM / QUERY params, not JSON
     data = dict(await request.form()) if request.headers.get("content-type", "").startswith("application/x-www-form-urlencoded") else dict(request.query_params)
 
+    return await run_blocking(process_call_now, data)
+
+
+def process_call_now(data: dict):
+    """Synchronous call-now handling; runs on the blocking-I/O thread pool."""
     print("📥 Bitrix call-now payload:", data)
 
     lead_id = data.get("ID") or data.get("lead_id")
@@ -19,12 +24,7 @@ async def bitrix_call_now(request: Request):
         return {"status": "ignored", "reason": "no lead id"}
 
     # Fetch full lead from Bitrix
-    res = requests.get(
-        f"{BITRIX_WEBHOOK}crm.lead.get.json",
-        params={"id": lead_id},
-        timeout=10
-    )
-    lead = res.json().get("result", {})
+    lead = get_lead(lead_id)
 
     phones = lead.get("PHONE") or []
     if not phones:
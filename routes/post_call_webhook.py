@@ -3,16 +3,32 @@ import os
 import json
 from fastapi import APIRouter,Request
 router = APIRouter()
-import requests
 from helpers.parsing_utils import parse_custom_extractions,parse_budget_to_number
 from helpers.time_utils import parse_rm_meeting_time,compute_busy_call_datetime
-from config import BITRIX_WEBHOOK, BOLNA_TOKEN, supabase
+from config import BOLNA_TOKEN
+from helpers.bitrix_client import bitrix_post, get_lead, BitrixBatch
+from helpers.bitrix_rate_limiter import rate_governor
+from helpers.lead_journal import append_lead_journal
 from datetime import datetime, timedelta
 from helpers.deal_utils import find_deal_for_lead,get_deal_stage_semantics
+from helpers.deal_waiter import wait_for_deal
+from helpers.blocking import run_async
+from helpers.ingest_queue import dispatch_webhook, register_handler
+from helpers.idempotency import post_call_dedupe
+from helpers.audit_log import audit_log
+from helpers.bitrix_metadata import (
+    DEAL_JUNK_STAGE_ID,
+    DEAL_STAGE_BY_HOTNESS,
+    LEAD_STATUS_CONVERTED,
+    LEAD_STATUS_JUNK,
+    LEAD_STATUS_PROCESSED,
+    LEAD_STATUS_UNANSWERED,
+)
 from helpers.retry_manager import (
     insert_or_increment_retry,
     cancel_retry_for_lead,
     mark_retry_attempt,
+    upsert_retry,
     apply_busy_call_override
 )
 from helpers.email_sender import  send_retry_email_once_per_day
@@ -24,6 +40,69 @@ from helpers.email_sender import  send_retry_email_once_per_day
 async def post_call_webhook(request: Request):
     """Receives post-call status from Bolna.ai and updates Supabase + Bitrix"""
     data = await request.json()
+    return await dispatch_webhook("post_call", data, process_post_call)
+
+
+FAILURE_STATES = ["busy", "failed", "no_answer", "no-answer", "not_reachable"]
+
+# Bitrix methods the busy / failed branches call after the retry attempt is
+# counted; a long block on them must fail the job before the count
+RETRY_BRANCH_BITRIX_METHODS = ("crm.timeline.comment.add", "crm.activity.add")
+
+
+def classify_post_call_event(data: dict) -> str:
+    """
+    Cheap, I/O-free routing of a Bolna callback from its top-level status
+    and the availability/hotness extractions. Returns "junk", "busy",
+    "failed", "completed", or "ignore" for intermediate events (queued,
+    ringing, in-progress, ...) that need no lead data at all.
+    """
+    status = data.get("status")
+    ce = parse_custom_extractions(data.get("custom_extractions"))
+    lead_hotness = (ce.get("Lead_hotness") or "").strip().upper()
+    user_availability = (ce.get("user_availability") or "").strip().lower()
+
+    if lead_hotness == "JUNK" or user_availability == "junk":
+        return "junk"
+    if user_availability in ("busy", "not_interpretable"):
+        return "busy"
+    if status in FAILURE_STATES:
+        return "failed"
+    if status == "completed":
+        return "completed"
+    return "ignore"
+
+
+def process_post_call(data: dict):
+    """Synchronous post-call processing; runs on the blocking-I/O thread pool."""
+    execution_id = data.get("id")
+    event_status = data.get("status")
+
+    # Non-terminal events are answered with zero outbound calls
+    kind = classify_post_call_event(data)
+    if kind == "ignore":
+        print(f"⏭️ Post-call event {execution_id} with status {event_status} — nothing to do")
+        return {"status": event_status}
+
+    # Raise BitrixRateLimited before any side effects: failing after the
+    # attempt is counted would make the redelivery count it again
+    if kind in ("busy", "failed"):
+        rate_governor.ensure_available(*RETRY_BRANCH_BITRIX_METHODS)
+
+    # Redelivered / repeated callbacks are rejected before any outbound I/O
+    if execution_id and not post_call_dedupe.claim(execution_id, event_status):
+        print(f"🔁 Duplicate post-call webhook ignored: {execution_id} / {event_status}")
+        return {"status": "duplicate", "id": execution_id}
+
+    try:
+        return handle_post_call(data)
+    except Exception:
+        if execution_id:
+            post_call_dedupe.release(execution_id, event_status)
+        raise
+
+
+def handle_post_call(data: dict):
     print("📥 Post-call webhook received:", data)
 
     # Extract lead info safely
@@ -98,19 +177,6 @@ async def post_call_webhook(request: Request):
 
     bolna_id = data.get("id")
 
-    br = requests.get(f"{BITRIX_WEBHOOK}crm.lead.get.json", params={"id": lead_id}, timeout=10)
-    lead_data = br.json().get("result", {})
-
-    first_name = lead_data.get("NAME")
-
-    lead_email = None
-    emails = lead_data.get("EMAIL") or []
-
-    for item in emails:
-        if item.get("VALUE"):
-            lead_email = item["VALUE"]
-            break
-
     # ============================================================
     # 🚫 HARD STOP: LEAD HOTNESS = JUNK → Kill Lead + Deal
     # ============================================================
@@ -118,18 +184,23 @@ async def post_call_webhook(request: Request):
     if lead_hotness == "JUNK" or user_availability == "junk" :
         print(f"🗑️ Lead hotness = JUNK → moving lead & deal to JUNK")
 
+        # Lead + deal writes go out as one Bitrix batch call
+        batch = BitrixBatch()
+
         # --------------------------------------------------------
         # 1. Move LEAD to JUNK
         # --------------------------------------------------------
-        requests.post(
-            f"{BITRIX_WEBHOOK}crm.lead.update.json",
-            json={
-                "id": lead_id,
-                "fields": {
-                    "STATUS_ID": "JUNK",
-                    "COMMENTS": "AI classified lead hotness as JUNK"
-                }
-            }
+        junk_fields = {"STATUS_ID": LEAD_STATUS_JUNK}
+        append_lead_journal(
+            lead_id,
+            "<p>AI classified lead hotness as JUNK</p>",
+            batch=batch,
+            update_fields=junk_fields
+        )
+        batch.add(
+            "crm.lead.update",
+            {"id": lead_id, "fields": junk_fields},
+            key="lead_junk"
         )
 
         # --------------------------------------------------------
@@ -142,30 +213,32 @@ async def post_call_webhook(request: Request):
         # 3. Move DEAL to LOST / JUNK stage
         # --------------------------------------------------------
         if deal_id:
-            DEAL_JUNK_STAGE_ID = "LOSE"  # 🔴 CHANGE if needed
-
-            requests.post(
-                f"{BITRIX_WEBHOOK}crm.deal.update.json",
-                json={
+            batch.add(
+                "crm.deal.update",
+                {
                     "id": deal_id,
                     "fields": {
                         "STAGE_ID": DEAL_JUNK_STAGE_ID
                     }
-                }
+                },
+                key="deal_lost"
             )
 
             # Optional: add timeline comment
-            requests.post(
-                f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                json={
+            batch.add(
+                "crm.timeline.comment.add",
+                {
                     "fields": {
                         "ENTITY_ID": deal_id,
                         "ENTITY_TYPE": "deal",
                         "COMMENT": "🗑️ Deal marked as LOST — AI classified lead as JUNK"
                     }
-                }
+                },
+                key="deal_comment"
             )
 
+        batch.execute()
+
         # --------------------------------------------------------
         # 4. Cancel retries & future calls
         # --------------------------------------------------------
@@ -180,6 +253,19 @@ async def post_call_webhook(request: Request):
 
 
  
+    # Lead is only needed past the JUNK hard stop
+    lead_data = get_lead(lead_id)
+
+    first_name = lead_data.get("NAME")
+
+    lead_email = None
+    emails = lead_data.get("EMAIL") or []
+
+    for item in emails:
+        if item.get("VALUE"):
+            lead_email = item["VALUE"]
+            break
+
     # --- CASE 2: user_availability = busy → treat like failure state ---
     if user_availability == "busy" or user_availability == "not_interpretable":
         print(f"📵 User busy → scheduling retry for lead {lead_id}")
@@ -209,8 +295,8 @@ async def post_call_webhook(request: Request):
             )
 
             if applied:
-                requests.post(
-                    f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+                bitrix_post(
+                    "crm.timeline.comment.add",
                     json={
                         "fields": {
                             "ENTITY_ID": lead_id,
@@ -224,11 +310,11 @@ async def post_call_webhook(request: Request):
 
     # 🔁 CASE B: no explicit time → normal retry flow
 
-        mark_retry_attempt(lead_id, bolna_call_id=bolna_id, status="busy")
+        mark_retry_attempt(lead_id, bolna_call_id=bolna_id, status="busy", lead_first_name=first_name)
 
         # Log on timeline
-        requests.post(
-            f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+        bitrix_post(
+            "crm.timeline.comment.add",
             json={
                 "fields": {
                     "ENTITY_ID": lead_id,
@@ -244,30 +330,27 @@ async def post_call_webhook(request: Request):
     # ==============================================================================
     # 🔥🔥🔥 1. HANDLE FAILED CALLS (busy / failed / no-answer / not-reachable)
     # ==============================================================================
-    FAILURE_STATES = ["busy", "failed", "no_answer", "no-answer", "not_reachable"]
-
     if status in FAILURE_STATES :
         print(f"⚠️ Call failed ({status}) → scheduling retry for lead {lead_id}")
 
-        # Create or increment retry
-        insert_or_increment_retry(
-            lead_id=lead_id,
-            phone=recipient_phone or to_number,
-            lead_name=lead_name,
-            lead_first_name=first_name,
-            reason=status,
-        )
-
-        # Store bolna call ID
-        mark_retry_attempt(
-            lead_id=lead_id,
-            bolna_call_id=bolna_id,
-            status=status
-        )
+        # Create the retry entry if needed, count the attempt and store the
+        # bolna call ID — one atomic RPC
+        try:
+            upsert_retry(
+                lead_id,
+                "ensure_and_increment",
+                status,
+                phone=recipient_phone or to_number,
+                lead_name=lead_name,
+                lead_first_name=first_name,
+                bolna_call_id=bolna_id,
+            )
+        except Exception as e:
+            print("❌ upsert_retry error:", e)
 
         # Add comment on Bitrix lead
-        requests.post(
-            f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
+        bitrix_post(
+            "crm.timeline.comment.add",
             json={
                 "fields": {
                     "ENTITY_ID": lead_id,
@@ -345,21 +428,14 @@ async def post_call_webhook(request: Request):
                 "raw_payload": data,
             }
 
-            res = supabase.table("bolna_call_logs").insert(payload).execute()
-            print("✅ Supabase insert success:", res)
+            audit_log.write("bolna_call_logs", payload)
+            print("✅ bolna_call_logs row queued")
         except Exception as e:
-            print("❌ Supabase insert error:", str(e))
+            print("❌ bolna_call_logs payload error:", str(e))
 
         # ✅ Update Bitrix comments log on LEAD
         if lead_id:
-            get_res = requests.get(
-                f"{BITRIX_WEBHOOK}crm.lead.get.json",
-                params={"id": lead_id},
-                timeout=10
-            )
-            lead_data = get_res.json().get("result", {})
-            existing_comments = lead_data.get("COMMENTS") or ""
-
+            # lead_data fetched above is reused; the journal never reads COMMENTS
             timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
             new_entry = f"<p><b>Post-call Update ({timestamp}):</b></p>"
             new_entry += f"<p>Transcript: {transcript}</p>"
@@ -380,11 +456,8 @@ async def post_call_webhook(request: Request):
             if call_summary:
                 new_entry += f"<p>Summary: {call_summary}</p>"
 
-            updated_comments = existing_comments + new_entry
-
             # Base fields for lead update
             update_fields = {
-                "COMMENTS": updated_comments,
                 "UF_CRM_1586952775435": "136"   # ⭐ Required for deal creation
             }
 
@@ -401,36 +474,41 @@ async def post_call_webhook(request: Request):
             if deal_id:
                 print("♻️ Existing deal found → updating DEAL (not lead). Deal_ID:", deal_id)
 
+                # All deal writes below go out as one Bitrix batch call
+                batch = BitrixBatch()
+
                 # --- 1. Add Transcript ---
-                requests.post(
-                    f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                    json={
+                batch.add(
+                    "crm.timeline.comment.add",
+                    {
                         "fields": {
                             "ENTITY_ID": deal_id,
                             "ENTITY_TYPE": "deal",
                             "COMMENT": f"<b>Transcript</b><br>{transcript}"
                         }
-                    }
+                    },
+                    key="transcript"
                 )
 
                 # --- 2. Add Summary ---
                 if call_summary:
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                        json={
+                    batch.add(
+                        "crm.timeline.comment.add",
+                        {
                             "fields": {
                                 "ENTITY_ID": deal_id,
                                 "ENTITY_TYPE": "deal",
                                 "COMMENT": f"<b>Summary</b><br>{call_summary}"
                             }
-                        }
+                        },
+                        key="summary"
                     )
 
                 # --- 3. Add Recording ---
                 if recording_url:
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                        json={
+                    batch.add(
+                        "crm.timeline.comment.add",
+                        {
                             "fields": {
                                 "ENTITY_ID": deal_id,
                                 "ENTITY_TYPE": "deal",
@@ -439,46 +517,35 @@ async def post_call_webhook(request: Request):
                                     f'<a href="{recording_url}" target="_blank">Click</a>'
                                 )
                             }
-                        }
+                        },
+                        key="recording"
                     )
 
-                # --- 4. Update opportunity ---
+                # --- 4. Update opportunity (+ stage below) in one deal.update ---
+                deal_fields = {}
                 if investment_budget_value:
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.deal.update.json",
-                        json={
-                            "id": deal_id,
-                            "fields": {
-                                "OPPORTUNITY": investment_budget_value,
-                                "CURRENCY_ID": "INR",
-                                "IS_MANUAL_OPPORTUNITY": "Y"
-                            }
-                        }
-                    )
+                    deal_fields.update({
+                        "OPPORTUNITY": investment_budget_value,
+                        "CURRENCY_ID": "INR",
+                        "IS_MANUAL_OPPORTUNITY": "Y"
+                    })
 
                 # ============================================================
                 # 🔥 Lead Hotness → Move Deal Stage
                 # ============================================================
 
-                if lead_hotness in ("COLD", "WARM", "HOT"):
-                    stage_map = {
-                        "COLD": "4",
-                        "WARM": "6",
-                        "HOT": "8"
-                    }
-
-                    new_stage = stage_map.get(lead_hotness)
+                if lead_hotness in DEAL_STAGE_BY_HOTNESS:
+                    new_stage = DEAL_STAGE_BY_HOTNESS[lead_hotness]
 
                     print(f"🔥 Updating deal {deal_id} to stage {new_stage} based on hotness = {lead_hotness}")
 
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.deal.update.json",
-                        json={
-                            "id": deal_id,
-                            "fields": {
-                                "STAGE_ID": new_stage
-                            }
-                        }
+                    deal_fields["STAGE_ID"] = new_stage
+
+                if deal_fields:
+                    batch.add(
+                        "crm.deal.update",
+                        {"id": deal_id, "fields": deal_fields},
+                        key="deal_update"
                     )
 
 
@@ -488,9 +555,9 @@ async def post_call_webhook(request: Request):
                     dt_start = datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S") - timedelta(minutes=150)
                     dt_end = dt_start + timedelta(minutes=30)
 
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.activity.add.json",
-                        json={
+                    batch.add(
+                        "crm.activity.add",
+                        {
                             "fields": {
                                 "OWNER_TYPE_ID": 2,
                                 "OWNER_ID": deal_id,
@@ -513,9 +580,14 @@ async def post_call_webhook(request: Request):
                                     }
                                 ],
                             }
-                        }
+                        },
+                        key="rm_meeting"
                     )
 
+                batch.execute()
+                if batch.result("rm_meeting"):
+                    print("📅 RM meeting activity created:", batch.result("rm_meeting"))
+
                 return {"status": "success", "flow": "deal_updated_existing"}
 
             # ------------------------------------------------------------
@@ -529,63 +601,63 @@ async def post_call_webhook(request: Request):
 
                     # Mark attended
                     update_fields["UF_CRM_1764239159240"] = "Y"
-                    update_fields["STATUS_ID"] = "PROCESSED"
+                    update_fields["STATUS_ID"] = LEAD_STATUS_PROCESSED
+
+                    # Update lead FIRST (journal entry goes in the same batch)
+                    lead_batch = BitrixBatch()
+                    append_lead_journal(lead_id, new_entry, batch=lead_batch, update_fields=update_fields)
 
-                    # Update lead FIRST
                     lead_update_payload = {"id": lead_id, "fields": update_fields}
                     print("📤 Sending lead update to Bitrix:", lead_update_payload)
 
-                    resp = requests.post(
-                        f"{BITRIX_WEBHOOK}crm.lead.update.json",
-                        json=lead_update_payload
-                    )
-
+                    lead_batch.add("crm.lead.update", lead_update_payload, key="lead_update")
+                    lead_batch.execute()
 
-                    print("🔴 Bitrix lead.update response:", resp.text)
 
+                    print("🔴 Bitrix lead.update response:", lead_batch.result("lead_update"), lead_batch.error("lead_update"))
 
 
-                    # Allow Bitrix automation to create deal (1–2 sec)
-                    import time
-                    time.sleep(2)
-                
 
-                # Find deal created by automation
-                deal_id = find_deal_for_lead(lead_id)
-                print("Deal_id:", deal_id)
+                    # Wait for Bitrix automation to create the deal: resolved by the
+                    # ONCRMDEALADD webhook, with a short async polling fallback
+                    deal_id = run_async(wait_for_deal, lead_id)
+                    print("Deal_id:", deal_id)
 
                 # ---------- Add timeline comments inside the deal ----------
                 if deal_id:
+                    batch = BitrixBatch()
 
                     # Transcript
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                        json={
+                    batch.add(
+                        "crm.timeline.comment.add",
+                        {
                             "fields": {
                                 "ENTITY_ID": deal_id,
                                 "ENTITY_TYPE": "deal",
                                 "COMMENT": f"<b>Transcript</b><br>{transcript}"
                             }
-                        }
+                        },
+                        key="transcript"
                     )
 
                     # Summary
-                    requests.post(
-                        f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                        json={
+                    batch.add(
+                        "crm.timeline.comment.add",
+                        {
                             "fields": {
                                 "ENTITY_ID": deal_id,
                                 "ENTITY_TYPE": "deal",
                                 "COMMENT": f"<b>Summary</b><br>{call_summary}"
                             }
-                        }
+                        },
+                        key="summary"
                     )
 
                     # Call recording link
                     if recording_url:
-                        requests.post(
-                            f"{BITRIX_WEBHOOK}crm.timeline.comment.add",
-                            json={
+                        batch.add(
+                            "crm.timeline.comment.add",
+                            {
                                 "fields": {
                                     "ENTITY_ID": deal_id,
                                     "ENTITY_TYPE": "deal",
@@ -594,21 +666,23 @@ async def post_call_webhook(request: Request):
                                         f'<a href="{recording_url}" target="_blank">Click to Listen</a>'
                                     )
                                 }
-                            }
+                            },
+                            key="recording"
                         )
 
                     # ---------- Update Deal Opportunity ----------
                     if investment_budget_value:
-                        requests.post(
-                            f"{BITRIX_WEBHOOK}crm.deal.update.json",
-                            json={
+                        batch.add(
+                            "crm.deal.update",
+                            {
                                 "id": deal_id,
                                 "fields": {
                                     "OPPORTUNITY": investment_budget_value,
                                     "CURRENCY_ID": "INR",
                                     "IS_MANUAL_OPPORTUNITY": "Y"
                                 }
-                            }
+                            },
+                            key="deal_update"
                         )
 
                     # ---------- Create RM Meeting Activity ----------
@@ -644,11 +718,16 @@ async def post_call_webhook(request: Request):
                             }
                         }
 
-                        requests.post(
-                            f"{BITRIX_WEBHOOK}crm.activity.add.json",
-                            json=act
+                        batch.add(
+                            "crm.activity.add",
+                            act,
+                            key="rm_meeting"
                         )
 
+                    batch.execute()
+                    if batch.result("rm_meeting"):
+                        print("📅 RM meeting activity created:", batch.result("rm_meeting"))
+
                 return {"status": "success", "flow": "deal_created"}
 
             # ------------------------------------------------------------
@@ -660,17 +739,20 @@ async def post_call_webhook(request: Request):
             
 
             update_fields["UF_CRM_1764323136141"] = "Y"
-            if lead_data.get("STATUS_ID") != "CONVERTED":
+            if lead_data.get("STATUS_ID") != LEAD_STATUS_CONVERTED:
                 if investment_budget_value is not None and 0 < investment_budget_value < 1000000:
-                    update_fields["STATUS_ID"] = "JUNK"   # Move to Junk
+                    update_fields["STATUS_ID"] = LEAD_STATUS_JUNK   # Move to Junk
                 else:
-                    update_fields["STATUS_ID"] = "14"   # Move to Unanswered to trigger automation
+                    update_fields["STATUS_ID"] = LEAD_STATUS_UNANSWERED   # Move to Unanswered to trigger automation
 
             # ---------- Put Opportunity inside LEAD (NOT DEAL) ----------
             if investment_budget_value:
                 update_fields["OPPORTUNITY"] = investment_budget_value
                 update_fields["CURRENCY_ID"] = "INR"
 
+            # Activity + lead update go out as one Bitrix batch call
+            batch = BitrixBatch()
+
             # ---------- Create RM Meeting Activity directly under LEAD ----------
             start_time, date_only = parse_rm_meeting_time(rm_meeting_time_raw)
 
@@ -704,18 +786,14 @@ async def post_call_webhook(request: Request):
                     }
                 }
 
-                requests.post(
-                    f"{BITRIX_WEBHOOK}crm.activity.add.json",
-                    json=lead_activity
-                )
+                batch.add("crm.activity.add", lead_activity, key="rm_meeting")
 
             # ---------- Update LEAD ----------
+            append_lead_journal(lead_id, new_entry, batch=batch, update_fields=update_fields)
             lead_update_payload = {"id": lead_id, "fields": update_fields}
 
-            requests.post(
-                f"{BITRIX_WEBHOOK}crm.lead.update.json",
-                json=lead_update_payload
-            )
+            batch.add("crm.lead.update", lead_update_payload, key="lead_update")
+            batch.execute()
 
             return {"status": "success", "flow": "lead_updated_only"}
 
@@ -723,3 +801,5 @@ async def post_call_webhook(request: Request):
 
     return {"status": status}
 
+
+register_handler("post_call", process_post_call)
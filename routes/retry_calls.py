@@ -3,6 +3,8 @@ from fastapi import APIRouter, Request, Header, HTTPException
 from helpers.retry_manager import process_due_retries,process_call_now_leads
 import os
 from helpers.logger import logger
+from helpers.blocking import run_blocking
+from helpers.slot_allocator import slot_allocator
 
 router = APIRouter()
 
@@ -21,7 +23,7 @@ async def cron_retry_calls(request: Request, x_cron_secret: str | None = Header(
 
     try:
         logger.info("📞 Processing CALL NOW leads")
-        call_now = process_call_now_leads(limit=50)
+        call_now = await run_blocking(process_call_now_leads, limit=50)
         call_now_count = len(call_now)
         logger.info(f"✅ Call-now processed: {call_now_count}")
     except Exception as e:
@@ -29,7 +31,7 @@ async def cron_retry_calls(request: Request, x_cron_secret: str | None = Header(
 
     try:
         logger.info("🔁 Processing retry queue")
-        results = process_due_retries()
+        results = await run_blocking(process_due_retries)
         retry_count = len(results)
         logger.info(f"✅ Retry calls processed: {retry_count}")
     except Exception as e:
@@ -42,3 +44,16 @@ async def cron_retry_calls(request: Request, x_cron_secret: str | None = Header(
         "call_now_processed": call_now_count,
         "retry_calls_processed": retry_count,
     }
+
+
+@router.get("/cron/retry-forecast")
+async def retry_forecast(hours: int = 24, bucket_minutes: int = 15, x_cron_secret: str | None = Header(None)):
+    """Due retry load per slot against the dial budget."""
+    if CRON_SECRET and x_cron_secret != CRON_SECRET:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    slots = await run_blocking(slot_allocator.forecast, hours=hours, bucket_minutes=bucket_minutes)
+    return {
+        "budget_per_minute": slot_allocator.budget,
+        "slots": slots,
+    }
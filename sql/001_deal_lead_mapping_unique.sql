@@ -0,0 +1,8 @@
+-- Lead <-> deal index persistence (helpers/deal_index.py)
+-- upsert(..., on_conflict="deal_id") needs a unique constraint on deal_id.
+
+create unique index if not exists deal_lead_mapping_deal_id_key
+    on deal_lead_mapping (deal_id);
+
+create index if not exists deal_lead_mapping_lead_id_idx
+    on deal_lead_mapping (lead_id);
@@ -0,0 +1,11 @@
+-- Idempotency for Bolna post-call webhooks (helpers/idempotency.py)
+
+create table if not exists bolna_webhook_events (
+    execution_id text not null,
+    status text not null,
+    received_at timestamptz not null default now(),
+    primary key (execution_id, status)
+);
+
+create index if not exists bolna_webhook_events_received_at_idx
+    on bolna_webhook_events (received_at);
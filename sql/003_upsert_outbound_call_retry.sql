@@ -0,0 +1,111 @@
+-- Atomic retry upsert (helpers/retry_manager.py: upsert_retry)
+--
+-- One statement replaces the select-then-update/insert pairs of
+-- insert_or_increment_retry and mark_retry_attempt. Scheduling policy stays
+-- in Python: the caller passes both candidate next_call_at values (first
+-- call / retry) and the function picks one from the locked row.
+--
+-- p_mode:
+--   ensure                make sure a due row exists (insert_or_increment_retry)
+--   increment             count an attempt, append the call id (mark_retry_attempt)
+--   ensure_and_increment  both, for the post-call failure branch
+--
+-- Requires one row per lead; remove duplicate lead_id rows before creating
+-- the unique index.
+--
+-- bolna_call_ids may be text[] or jsonb depending on how the table was
+-- created; the append checks the column type and uses the matching
+-- operators. New rows leave it NULL, which the readers treat as empty.
+
+create unique index if not exists outbound_call_retries_lead_id_key
+    on outbound_call_retries (lead_id);
+
+create or replace function upsert_outbound_call_retry(
+    p_lead_id text,
+    p_mode text,
+    p_status text,
+    p_next_call_first timestamptz,
+    p_next_call_retry timestamptz,
+    p_phone text default null,
+    p_lead_name text default null,
+    p_lead_first_name text default null,
+    p_bolna_call_id text default null,
+    p_force_attempts int default null,
+    p_max_attempts int default 10
+) returns outbound_call_retries
+language plpgsql
+as $$
+declare
+    v_row outbound_call_retries;
+    v_now timestamptz := now();
+    v_attempts int;
+    v_max int;
+begin
+    insert into outbound_call_retries (
+        lead_id, lead_name, lead_first_name, phone, attempts, max_attempts,
+        next_call_at, last_status, created_at, updated_at, paused
+    ) values (
+        p_lead_id, p_lead_name, p_lead_first_name, coalesce(p_phone, 'unknown'),
+        coalesce(p_force_attempts, 0), p_max_attempts,
+        case when coalesce(p_force_attempts, 0) = 0 then p_next_call_first else p_next_call_retry end,
+        p_status, v_now, v_now, false
+    )
+    on conflict (lead_id) do nothing
+    returning * into v_row;
+
+    if found then
+        -- Fresh row: only the combined mode goes on to count the attempt
+        if p_mode <> 'ensure_and_increment' then
+            return v_row;
+        end if;
+    else
+        -- Existing row: the lock serialises concurrent webhooks for this lead
+        select * into v_row from outbound_call_retries
+        where lead_id = p_lead_id
+        for update;
+
+        if p_mode = 'ensure' then
+            -- Paused, or already scheduled in the future: leave it alone
+            if v_row.paused or v_row.next_call_at > v_now then
+                return v_row;
+            end if;
+
+            update outbound_call_retries set
+                next_call_at = case when coalesce(v_row.attempts, 0) = 0
+                                    then p_next_call_first else p_next_call_retry end,
+                last_status = p_status,
+                updated_at = v_now
+            where lead_id = p_lead_id
+            returning * into v_row;
+            return v_row;
+        end if;
+    end if;
+
+    v_attempts := coalesce(v_row.attempts, 0) + 1;
+    v_max := coalesce(v_row.max_attempts, p_max_attempts);
+
+    if p_bolna_call_id is not null then
+        -- Only the branch for the actual column type is ever planned
+        if pg_typeof(v_row.bolna_call_ids) in ('jsonb'::regtype, 'json'::regtype) then
+            update outbound_call_retries set
+                bolna_call_ids = coalesce(bolna_call_ids::jsonb, '[]'::jsonb) || to_jsonb(p_bolna_call_id)
+            where lead_id = p_lead_id;
+        else
+            update outbound_call_retries set
+                bolna_call_ids = array_append(coalesce(bolna_call_ids, '{}'), p_bolna_call_id)
+            where lead_id = p_lead_id;
+        end if;
+    end if;
+
+    update outbound_call_retries set
+        attempts = v_attempts,
+        next_call_at = p_next_call_retry,
+        updated_at = v_now,
+        paused = case when v_attempts >= v_max then true else paused end,
+        last_status = case when v_attempts >= v_max then 'max_attempts_reached' else p_status end
+    where lead_id = p_lead_id
+    returning * into v_row;
+
+    return v_row;
+end;
+$$;
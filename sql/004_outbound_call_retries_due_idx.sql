@@ -0,0 +1,6 @@
+-- Due-retry scan (sql/005 claim_due_retries)
+-- Oldest-first (next_call_at, lead_id) order over unpaused rows only.
+
+create index if not exists outbound_call_retries_due_idx
+    on outbound_call_retries (next_call_at, lead_id)
+    where paused = false;
@@ -0,0 +1,77 @@
+-- Lease-based claiming of due retries (helpers/retry_manager.py: claim_due_retries)
+--
+-- Any number of workers (process_retries.py, /cron/retry-calls) call
+-- claim_due_retries; SKIP LOCKED hands each one a disjoint batch and the
+-- lease keeps other workers off the rows until it is released or expires.
+--
+-- A batch can take longer than its lease (dials are capped per agent and
+-- each waits on Bolna and Bitrix), so renew_retry_claim re-checks and
+-- extends the lease right before every dial; a lost lease skips the dial.
+--
+-- Only the columns the due pipeline reads are returned. busy_call_at comes
+-- back as text because the pipeline handles unparseable values itself.
+
+alter table outbound_call_retries
+    add column if not exists claimed_by text,
+    add column if not exists lease_until timestamptz;
+
+-- The return type changed from setof outbound_call_retries
+drop function if exists claim_due_retries(text, int, int, text[]);
+
+create or replace function claim_due_retries(
+    p_worker text,
+    p_limit int default 200,
+    p_lease_seconds int default 300,
+    p_lead_ids text[] default null
+) returns table (
+    lead_id text,
+    phone text,
+    lead_name text,
+    lead_first_name text,
+    attempts int,
+    max_attempts int,
+    next_call_at timestamptz,
+    last_call_at timestamptz,
+    busy_call_at text,
+    busy_call_consumed boolean
+)
+language sql
+as $$
+    with picked as (
+        select lead_id
+        from outbound_call_retries
+        where paused = false
+          and next_call_at <= now()
+          and (lease_until is null or lease_until < now())
+          and (p_lead_ids is null or lead_id = any(p_lead_ids))
+        order by next_call_at, lead_id
+        limit p_limit
+        for update skip locked
+    )
+    update outbound_call_retries r
+    set claimed_by = p_worker,
+        lease_until = now() + make_interval(secs => p_lease_seconds)
+    from picked
+    where r.lead_id = picked.lead_id
+    returning r.lead_id::text, r.phone::text, r.lead_name::text, r.lead_first_name::text,
+              r.attempts::int, r.max_attempts::int, r.next_call_at::timestamptz,
+              r.last_call_at::timestamptz, r.busy_call_at::text, r.busy_call_consumed::boolean;
+$$;
+
+create or replace function renew_retry_claim(
+    p_worker text,
+    p_lead_id text,
+    p_lease_seconds int default 300
+) returns boolean
+language sql
+as $$
+    with renewed as (
+        update outbound_call_retries
+        set lease_until = now() + make_interval(secs => p_lease_seconds)
+        where lead_id = p_lead_id
+          and claimed_by = p_worker
+          and lease_until > now()
+        returning 1
+    )
+    select exists (select 1 from renewed);
+$$;
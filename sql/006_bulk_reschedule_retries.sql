@@ -0,0 +1,31 @@
+-- Set-based reschedule (helpers/retry_manager.py: _reschedule_many)
+-- Moves any number of leads, each to its own next_call_at, in one UPDATE,
+-- and returns the lead ids it actually moved (paused rows are skipped).
+
+-- paused is written as a boolean everywhere, but nothing enforced it. The
+-- claim (sql/005), the due index (sql/004) and the scheduler all filter on
+-- paused = false, so a NULL row has never been dialed. Backfill those as
+-- paused (what they already behaved as) and make NULL impossible, so every
+-- reader agrees on what is active.
+update outbound_call_retries set paused = true where paused is null;
+alter table outbound_call_retries
+    alter column paused set default false,
+    alter column paused set not null;
+
+-- The return type changed from integer
+drop function if exists bulk_reschedule_retries(text[], timestamptz[]);
+
+create or replace function bulk_reschedule_retries(
+    p_lead_ids text[],
+    p_next_call_at timestamptz[]
+) returns table (lead_id text)
+language sql
+as $$
+    update outbound_call_retries r
+    set next_call_at = v.next_call_at,
+        updated_at = now()
+    from unnest(p_lead_ids, p_next_call_at) as v(lead_id, next_call_at)
+    where r.lead_id = v.lead_id
+      and r.paused = false
+    returning r.lead_id::text;
+$$;
@@ -0,0 +1,146 @@
+-- Append-only call attempts (sql/003 upsert_outbound_call_retry)
+--
+-- Bolna call ids move out of the ever-growing outbound_call_retries.bolna_call_ids
+-- array into one row per attempt, so queue rows stay fixed-size.
+--
+-- The old column is kept so the previous release keeps working during the
+-- rollout; sql/008 drops it once every instance runs the new code.
+
+create table if not exists retry_call_attempts (
+    id bigserial primary key,
+    lead_id text not null,
+    attempt_no int not null,
+    bolna_call_id text,
+    status text,
+    created_at timestamptz not null default now()
+);
+
+-- One row per attempt number: attempt_no is the row's attempts counter
+-- after the increment, so duplicates mean the two have drifted apart
+drop index if exists retry_call_attempts_lead_id_idx;
+create unique index if not exists retry_call_attempts_lead_attempt_key
+    on retry_call_attempts (lead_id, attempt_no);
+
+-- Copy existing ids; the array order is the attempt order, numbered so the
+-- last id is the row's current attempts count (the next increment writes
+-- attempts + 1). Ids beyond the counter get numbers <= 0 rather than
+-- colliding. Timestamps of old attempts were never stored, so the row's
+-- updated_at stands in.
+-- bolna_call_ids is text[] or jsonb depending on how the table was created,
+-- so the element expansion is picked from the column type.
+do $$
+declare
+    v_type text;
+    v_expand text;
+    v_length text;
+begin
+    select data_type into v_type
+    from information_schema.columns
+    where table_schema = current_schema()
+      and table_name = 'outbound_call_retries'
+      and column_name = 'bolna_call_ids';
+
+    if v_type is null then
+        return;  -- column already dropped
+    elsif v_type in ('jsonb', 'json') then
+        v_expand := 'jsonb_array_elements_text(r.bolna_call_ids::jsonb)';
+        v_length := 'jsonb_array_length(r.bolna_call_ids::jsonb)';
+    else
+        v_expand := 'unnest(r.bolna_call_ids)';
+        v_length := 'cardinality(r.bolna_call_ids)';
+    end if;
+
+    execute format($q$
+        insert into retry_call_attempts (lead_id, attempt_no, bolna_call_id, status, created_at)
+        select r.lead_id, coalesce(r.attempts, 0) - %s + a.n, a.bolna_call_id, null, coalesce(r.updated_at, now())
+        from outbound_call_retries r
+        cross join lateral %s with ordinality as a(bolna_call_id, n)
+        where r.bolna_call_ids is not null
+          and not exists (select 1 from retry_call_attempts x where x.lead_id = r.lead_id)
+        on conflict (lead_id, attempt_no) do nothing
+    $q$, v_length, v_expand);
+end;
+$$;
+
+-- Same contract as before; the increment now appends an attempt row
+create or replace function upsert_outbound_call_retry(
+    p_lead_id text,
+    p_mode text,
+    p_status text,
+    p_next_call_first timestamptz,
+    p_next_call_retry timestamptz,
+    p_phone text default null,
+    p_lead_name text default null,
+    p_lead_first_name text default null,
+    p_bolna_call_id text default null,
+    p_force_attempts int default null,
+    p_max_attempts int default 10
+) returns outbound_call_retries
+language plpgsql
+as $$
+declare
+    v_row outbound_call_retries;
+    v_now timestamptz := now();
+    v_attempts int;
+    v_max int;
+begin
+    insert into outbound_call_retries (
+        lead_id, lead_name, lead_first_name, phone, attempts, max_attempts,
+        next_call_at, last_status, created_at, updated_at, paused
+    ) values (
+        p_lead_id, p_lead_name, p_lead_first_name, coalesce(p_phone, 'unknown'),
+        coalesce(p_force_attempts, 0), p_max_attempts,
+        case when coalesce(p_force_attempts, 0) = 0 then p_next_call_first else p_next_call_retry end,
+        p_status, v_now, v_now, false
+    )
+    on conflict (lead_id) do nothing
+    returning * into v_row;
+
+    if found then
+        -- Fresh row: only the combined mode goes on to count the attempt
+        if p_mode <> 'ensure_and_increment' then
+            return v_row;
+        end if;
+    else
+        -- Existing row: the lock serialises concurrent webhooks for this lead
+        select * into v_row from outbound_call_retries
+        where lead_id = p_lead_id
+        for update;
+
+        if p_mode = 'ensure' then
+            -- Paused, or already scheduled in the future: leave it alone
+            if v_row.paused or v_row.next_call_at > v_now then
+                return v_row;
+            end if;
+
+            update outbound_call_retries set
+                next_call_at = case when coalesce(v_row.attempts, 0) = 0
+                                    then p_next_call_first else p_next_call_retry end,
+                last_status = p_status,
+                updated_at = v_now
+            where lead_id = p_lead_id
+            returning * into v_row;
+            return v_row;
+        end if;
+    end if;
+
+    v_attempts := coalesce(v_row.attempts, 0) + 1;
+    v_max := coalesce(v_row.max_attempts, p_max_attempts);
+
+    -- A recreated retry row restarts its counter; keep the earlier record
+    insert into retry_call_attempts (lead_id, attempt_no, bolna_call_id, status, created_at)
+    values (p_lead_id, v_attempts, p_bolna_call_id, p_status, v_now)
+    on conflict (lead_id, attempt_no) do nothing;
+
+    update outbound_call_retries set
+        attempts = v_attempts,
+        next_call_at = p_next_call_retry,
+        updated_at = v_now,
+        paused = case when v_attempts >= v_max then true else paused end,
+        last_status = case when v_attempts >= v_max then 'max_attempts_reached' else p_status end
+    where lead_id = p_lead_id
+    returning * into v_row;
+
+    return v_row;
+end;
+$$;
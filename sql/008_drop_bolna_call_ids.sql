@@ -0,0 +1,48 @@
+-- Drop outbound_call_retries.bolna_call_ids (superseded by retry_call_attempts, sql/007)
+--
+-- Run only after the deploy that ships sql/007 is live everywhere: older
+-- instances still write this column through upsert_outbound_call_retry and
+-- the table API.
+--
+-- Picks up ids appended by old instances between sql/007 and now, numbered
+-- like the 007 backfill (last id = attempts), then drops the column. Ids
+-- already copied, or whose attempt number is already recorded, are skipped.
+
+do $$
+declare
+    v_type text;
+    v_expand text;
+    v_length text;
+begin
+    select data_type into v_type
+    from information_schema.columns
+    where table_schema = current_schema()
+      and table_name = 'outbound_call_retries'
+      and column_name = 'bolna_call_ids';
+
+    if v_type is null then
+        return;
+    elsif v_type in ('jsonb', 'json') then
+        v_expand := 'jsonb_array_elements_text(r.bolna_call_ids::jsonb)';
+        v_length := 'jsonb_array_length(r.bolna_call_ids::jsonb)';
+    else
+        v_expand := 'unnest(r.bolna_call_ids)';
+        v_length := 'cardinality(r.bolna_call_ids)';
+    end if;
+
+    execute format($q$
+        insert into retry_call_attempts (lead_id, attempt_no, bolna_call_id, status, created_at)
+        select r.lead_id, coalesce(r.attempts, 0) - %s + a.n, a.bolna_call_id, null, coalesce(r.updated_at, now())
+        from outbound_call_retries r
+        cross join lateral %s with ordinality as a(bolna_call_id, n)
+        where r.bolna_call_ids is not null
+          and not exists (
+              select 1 from retry_call_attempts x
+              where x.lead_id = r.lead_id and x.bolna_call_id = a.bolna_call_id
+          )
+        on conflict (lead_id, attempt_no) do nothing
+    $q$, v_length, v_expand);
+end;
+$$;
+
+alter table outbound_call_retries drop column if exists bolna_call_ids;
@@ -0,0 +1,5 @@
+-- Incremental scheduler sync (helpers/retry_scheduler.py: _fetch_since)
+-- Reads rows changed since a watermark, ordered by (updated_at, lead_id).
+
+create index if not exists outbound_call_retries_updated_at_idx
+    on outbound_call_retries (updated_at, lead_id);